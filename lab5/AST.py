@@ -4,6 +4,8 @@ from typing import Any, List, Optional
 class Node(object):
     type: Optional[Any] = None
     size: Optional[Any] = None
+    # the type of a matrix's elements, None when not known
+    element: Optional[Any] = None
 
     def accept(self, visitor):
         return visitor.visit(self)
@@ -34,6 +36,15 @@ class Uminus(Node):
         self.line = line
 
 
+class Elementwise(Node):
+    # a tree of element-wise operations evaluated in one pass: tree is
+    # (operator, operand...) with leaf indices into leaves as operands
+    def __init__(self, tree, leaves: List[Any], line=0):
+        self.tree = tree
+        self.leaves = leaves
+        self.line = line
+
+
 class Assignment(Node):
     def __init__(self, operator, var, expression, line=0):
         self.operator = operator
@@ -168,6 +179,8 @@ class Number(Node):
     def __init__(self, value, line=0):
         self.value = value
         self.line = line
+        # the value the engines use, an int when written with digits only
+        self.constant = int(value) if value.isdigit() else float(value)
 
 
 class VectorRef(Node):
@@ -192,6 +205,13 @@ class MatrixFunction(Node):
         self.line = line
 
 
+class FunctionCall(Node):
+    def __init__(self, name, args: List[Any], line=0):
+        self.name = name
+        self.args = args
+        self.line = line
+
+
 class ToPrint(Node):
     def __init__(self, values: List[Any], line=0):
         self.values = values
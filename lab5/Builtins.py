@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+
+try:
+    from scipy.linalg import lu_factor
+except ImportError:
+    lu_factor = None
+
+numbers = ('int', 'float')
+matrices = ('matrix', 'vector')
+
+
+def sequence(first, last):
+    # a range passed to a function stands for its values, as in a for loop
+    return np.arange(first, last + 1)
+
+
+def number(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def elementwise(function, ufunc):
+    # math on a number, one ufunc call over a whole matrix
+    def apply(args):
+        value = args[0]
+        return ufunc(value) if value.__class__ is np.ndarray else function(value)
+    return apply
+
+
+def reduction(function):
+    def apply(args):
+        value = args[0]
+        return number(function(value)) if value.__class__ is np.ndarray else value
+    return apply
+
+
+def extreme(function, ufunc, pairwise):
+    # the least or greatest element of a matrix, or of two operands, which
+    # for matrices is taken element by element
+    reduce = reduction(function)
+
+    def apply(args):
+        if len(args) == 1:
+            return reduce(args)
+        if args[0].__class__ is np.ndarray or args[1].__class__ is np.ndarray:
+            return ufunc(args[0], args[1])
+        return pairwise(args[0], args[1])
+    return apply
+
+
+def decompose(args):
+    # the LU factors of A with partial pivoting as LAPACK's getrf leaves
+    # them, U on and above the diagonal and the multipliers of L below it,
+    # followed by a column of pivots: step k exchanged rows k and pivots[k].
+    # scipy calls getrf itself when it is installed
+    if lu_factor is not None:
+        factors, pivots = lu_factor(args[0])
+    else:
+        factors, pivots = eliminate(np.array(args[0], dtype=float))
+    return np.column_stack((factors, pivots))
+
+
+def eliminate(factors):
+    # getrf in numpy, one update of the trailing rows for each column
+    rows, cols = factors.shape
+    pivots = np.arange(rows)
+    for k in range(min(rows - 1, cols)):
+        pivot = k + int(np.argmax(np.abs(factors[k:, k])))
+        pivots[k] = pivot
+        if pivot != k:
+            factors[[k, pivot]] = factors[[pivot, k]]
+        if factors[k, k] != 0:
+            factors[k + 1:, k] /= factors[k, k]
+            factors[k + 1:, k + 1:] -= np.outer(factors[k + 1:, k], factors[k, k + 1:])
+    return factors, pivots
+
+
+def solve(args):
+    return np.linalg.solve(args[0], args[1])
+
+
+def inverse(args):
+    return np.linalg.inv(args[0])
+
+
+def determinant(args):
+    return float(np.linalg.det(args[0]))
+
+
+def norm(args):
+    value = args[0]
+    return float(np.linalg.norm(value)) if value.__class__ is np.ndarray else float(abs(value))
+
+
+def truth(function):
+    return lambda args: bool(function(args[0]))
+
+
+def elementwise_type(types):
+    kind, = types
+    return 'float' if kind in numbers else kind if kind in matrices else None
+
+
+def reduction_type(types):
+    kind, = types
+    return kind if kind in numbers else 'float' if kind in matrices else None
+
+
+def extreme_type(types):
+    if len(types) == 1:
+        return reduction_type(types)
+    if any(kind not in numbers + matrices for kind in types):
+        return None
+    if 'matrix' in types or 'vector' in types:
+        return 'matrix' if 'matrix' in types else 'vector'
+    return 'float' if 'float' in types else 'int'
+
+
+def norm_type(types):
+    kind, = types
+    return 'float' if kind in numbers + matrices else None
+
+
+def linear_type(result):
+    def signature(types):
+        return result if types[0] == 'matrix' and all(kind in matrices for kind in types[1:]) else None
+    return signature
+
+
+def solve_type(types):
+    return types[1] if types[0] == 'matrix' and types[1] in matrices else None
+
+
+def square(size):
+    if size[0] != size[1]:
+        raise ValueError(f'{size[0]}x{size[1]} matrix is not square')
+    return size
+
+
+def square_size(sizes):
+    return square(sizes[0])
+
+
+def solve_size(sizes):
+    # A x = b for a square A and b with as many rows, x of b's shape; a
+    # vector is a single row, so it has to be transposed first
+    (rows, _), (b_rows, b_cols) = square(sizes[0]), sizes[1]
+    if b_rows != rows:
+        raise ValueError(f'{rows}x{rows} system with a {b_rows}x{b_cols} right-hand side')
+    return sizes[1]
+
+
+def lu_size(sizes):
+    # the factors and a column of pivots
+    rows, cols = square(sizes[0])
+    return rows, cols + 1
+
+
+def truth_type(types):
+    kind, = types
+    return 'bool' if kind in matrices + ('mask',) else None
+
+
+# A function of the language: its implementation takes the list of argument
+# values, signature gives TypeChecker the result type for the argument types
+# or None when they do not fit, and shape the result's size for the argument
+# sizes, raising ValueError when they do not fit; without it a matrix result
+# has the size of an argument of its type. For the argument counts in
+# reduces the result is never a matrix.
+class Builtin(object):
+    def __init__(self, function, signature, arities=(1,), reduces=(), shape=None):
+        self.function = function
+        self.signature = signature
+        self.arities = arities
+        self.reduces = reduces
+        self.shape = shape
+
+
+functions = {
+    'sqrt': Builtin(elementwise(math.sqrt, np.sqrt), elementwise_type),
+    'exp': Builtin(elementwise(math.exp, np.exp), elementwise_type),
+    'sin': Builtin(elementwise(math.sin, np.sin), elementwise_type),
+    'sum': Builtin(reduction(np.sum), reduction_type, reduces=(1,)),
+    'prod': Builtin(reduction(np.prod), reduction_type, reduces=(1,)),
+    'min': Builtin(extreme(np.min, np.minimum, min), extreme_type, arities=(1, 2), reduces=(1,)),
+    'max': Builtin(extreme(np.max, np.maximum, max), extreme_type, arities=(1, 2), reduces=(1,)),
+    'norm': Builtin(norm, norm_type, reduces=(1,)),
+    'solve': Builtin(solve, solve_type, arities=(2,), shape=solve_size),
+    'inv': Builtin(inverse, linear_type('matrix'), shape=square_size),
+    'det': Builtin(determinant, linear_type('float'), reduces=(1,), shape=square_size),
+    'lu': Builtin(decompose, linear_type('matrix'), shape=lu_size),
+    'any': Builtin(truth(np.any), truth_type, reduces=(1,)),
+    'all': Builtin(truth(np.all), truth_type, reduces=(1,)),
+}
@@ -0,0 +1,429 @@
+import ast
+import hashlib
+import importlib.util
+import marshal
+import os
+
+import AST
+from Exceptions import *
+from visit import *
+from numpy import array
+from Interpreter import multiply, negate, mat_add, mat_sub, mat_mul, mat_div, matrix_creators
+from Interpreter import scalar, item, submatrix, assign, writable, augment, share, transpose, printable
+from Memory import UNSET
+from Resolver import Resolver, scalar_symbols, never_matrix
+from Fusion import evaluate
+from Builtins import functions, sequence
+
+native_operators = {'+', '-', '*', '/', '<', '>', '<=', '>=', '==', '!='}
+
+operator_functions = {
+    '.+': 'mat_add',
+    '.-': 'mat_sub',
+    '.*': 'mat_mul',
+    './': 'mat_div',
+}
+
+
+def counted(first, last):
+    if first.__class__ is int and last.__class__ is int:
+        return range(first, last + 1)
+    return stepped(first, last)
+
+
+def stepped(first, last):
+    while first <= last:
+        yield first
+        first += 1
+
+
+def after(first, last):
+    # value a for-loop counter has when the loop runs to completion
+    for value in stepped(first, last):
+        first = value + 1
+    return first
+
+
+runtime = {
+    'UNSET': UNSET,
+    'counted': counted,
+    'after': after,
+    'array': array,
+    'scalar': scalar,
+    'item': item,
+    'submatrix': submatrix,
+    'assign': assign,
+    'writable': writable,
+    'printable': printable,
+    'multiply': multiply,
+    'augment': augment,
+    'share': share,
+    'transpose': transpose,
+    'elementwise': evaluate,
+    'negate': negate,
+    'mat_add': mat_add,
+    'mat_sub': mat_sub,
+    'mat_mul': mat_mul,
+    'mat_div': mat_div,
+    'matrix_creators': matrix_creators,
+    'functions': functions,
+    'sequence': sequence,
+    'BreakException': BreakException,
+    'ContinueException': ContinueException,
+    'ReturnValueException': ReturnValueException,
+}
+
+# bump whenever the generated code changes, so stale cached code is not run
+VERSION = 1
+
+code_cache = {}
+
+
+def source_hash(source, passes, filename):
+    # the .m source, the passes that shaped its tree and the generator
+    # version decide the code object
+    key = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+    key.update(f'{VERSION}:{filename}:{",".join(passes)}:'.encode())
+    key.update(source.encode())
+    return key.hexdigest()
+
+
+def load_code(program, source, passes=(), filename='<m>', cache_dir=None):
+    # code objects are cached by the hash of the .m source in memory and,
+    # with cache_dir, on disk, so a script that was compiled once skips
+    # resolution, generation and Python's compilation
+    key = source_hash(source, passes, filename)
+    code = code_cache.get(key)
+    path = os.path.join(cache_dir, key + '.mpyc') if cache_dir is not None else None
+    if code is None and path is not None and os.path.isfile(path):
+        with open(path, 'rb') as file:
+            code = marshal.load(file)
+    if code is None:
+        code = CodeGenerator().compile(program, filename)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, 'wb') as file:
+                marshal.dump(code, file)
+    code_cache[key] = code
+    return code
+
+
+def execute(code):
+    exec(code, dict(runtime))
+
+
+# Translates a program into Python source for a single function, so .m
+# variables become fast locals and loops run as native for/while with
+# break/continue. Every generated line remembers the .m line it came from
+# and the compiled code reports those lines in tracebacks.
+class CodeGenerator(object):
+    def __init__(self):
+        self.lines = []
+        self.level = 0
+        self.loop_depth = 0
+        self.temp_count = 0
+        self.scalars = set()
+
+    def generate(self, program):
+        Resolver().resolve(program)
+        self.scalars = scalar_symbols(program)
+        self.emit('def main():', program.line)
+        self.level += 1
+        self.enter(program.scope, program.line)
+        program.accept(self)
+        self.emit('pass', program.line)
+        self.level -= 1
+        self.emit('main()', program.line)
+        return '\n'.join(text for text, line in self.lines) + '\n'
+
+    def compile(self, program, filename='<m>'):
+        return self.translate(self.generate(program), filename)
+
+    def translate(self, source, filename='<m>'):
+        tree = ast.parse(source, filename)
+        for node in ast.walk(tree):
+            if hasattr(node, 'lineno'):
+                node.lineno = self.lines[node.lineno - 1][1]
+                node.col_offset = 0
+                node.end_lineno = None
+                node.end_col_offset = None
+        return compile(tree, filename, 'exec')
+
+    def run(self, program, source=None, passes=(), filename='<m>', cache_dir=None):
+        # passes names the optimizations run on the program's tree
+        if source is None:
+            code = self.compile(program, filename)
+        else:
+            code = load_code(program, source, passes, filename, cache_dir)
+        execute(code)
+
+    def emit(self, text, line):
+        self.lines.append(('    ' * self.level + text, line))
+
+    def temp(self):
+        self.temp_count += 1
+        return f'_t{self.temp_count}'
+
+    @staticmethod
+    def name(symbol):
+        return f'{symbol.name}_{symbol.index}'
+
+    def enter(self, scope, line):
+        for symbol in scope.symbols.values():
+            if symbol.used:
+                self.emit(f'{self.name(symbol)} = {"UNSET" if symbol.guarded else "None"}', line)
+
+    def read(self, binding):
+        symbols = binding.symbols
+        if not symbols:
+            return 'None'
+        if binding.static or (len(symbols) == 1 and not symbols[0].guarded):
+            return self.name(symbols[0])
+        if binding.bound:
+            code, symbols = self.name(symbols[-1]), symbols[:-1]
+        else:
+            code = 'None'
+        for symbol in reversed(symbols):
+            name = self.name(symbol)
+            code = f'({name} if {name} is not UNSET else {code})'
+        return code
+
+    def write(self, binding, value, line):
+        symbols = binding.symbols
+        if len(symbols) == 1:
+            self.emit(f'{self.name(symbols[0])} = {value}', line)
+            return
+        temp = self.temp()
+        self.emit(f'{temp} = {value}', line)
+        for i, symbol in enumerate(symbols[:-1]):
+            self.emit(f'{"if" if i == 0 else "elif"} {self.name(symbol)} is not UNSET:', line)
+            self.emit(f'    {self.name(symbol)} = {temp}', line)
+        self.emit('else:', line)
+        self.emit(f'    {self.name(symbols[-1])} = {temp}', line)
+
+    def block(self, node, scope=None):
+        self.level += 1
+        if scope is not None:
+            self.enter(scope, node.line)
+        node.accept(self)
+        self.emit('pass', node.line)
+        self.level -= 1
+
+    @staticmethod
+    def binary(operator, left, right):
+        if operator in native_operators:
+            return f'({left} {operator} {right})'
+        return f'{operator_functions[operator]}({left}, {right})'
+
+    @on('node')
+    def visit(self, node):
+        pass
+
+    @when(AST.Instructions)
+    def visit(self, node: AST.Instructions):
+        for instruction in node.instructions:
+            instruction.accept(self)
+
+    @when(AST.BinaryExpression)
+    def visit(self, node: AST.BinaryExpression):
+        if node.operator == '*':
+            return self.product(node.left, node.right, node.left.accept(self), node.right.accept(self))
+        return self.binary(node.operator, node.left.accept(self), node.right.accept(self))
+
+    @when(AST.Condition)
+    def visit(self, node: AST.Condition):
+        return self.binary(node.operator, node.left.accept(self), node.right.accept(self))
+
+    @when(AST.Transposition)
+    def visit(self, node: AST.Transposition):
+        return f'transpose({node.matrix.accept(self)})'
+
+    @when(AST.Uminus)
+    def visit(self, node: AST.Uminus):
+        return self.negation(node, node.right.accept(self))
+
+    def negation(self, node, operand):
+        return f'negate({operand})'
+
+    @when(AST.Elementwise)
+    def visit(self, node: AST.Elementwise):
+        leaves = ''.join(f'{leaf.accept(self)}, ' for leaf in node.leaves)
+        if node.dead is not None:
+            return f'elementwise({node.tree!r}, ({leaves}), {self.read(node.dead)})'
+        return f'elementwise({node.tree!r}, ({leaves}))'
+
+    def product(self, left_node, right_node, left, right):
+        # a native * unless both operands may be matrices
+        if self.never_matrix(left_node) or self.never_matrix(right_node):
+            return f'({left} * {right})'
+        return f'multiply({left}, {right})'
+
+    def never_matrix(self, node):
+        return never_matrix(node, self.scalars)
+
+    @when(AST.Var)
+    def visit(self, node: AST.Var):
+        return self.read(node.binding)
+
+    @when(AST.Number)
+    def visit(self, node: AST.Number):
+        return repr(node.constant)
+
+    @when(AST.String)
+    def visit(self, node: AST.String):
+        return repr(str(node.string)[1:-1])
+
+    @when(AST.If)
+    def visit(self, node: AST.If):
+        self.emit(f'if {node.cond.accept(self)}:', node.line)
+        self.block(node.instr, node.scope)
+
+    @when(AST.Ifelse)
+    def visit(self, node: AST.Ifelse):
+        self.emit(f'if {node.cond.accept(self)}:', node.line)
+        self.block(node.instr, node.scope)
+        self.emit('else:', node.line)
+        self.block(node.instr_else, node.else_scope)
+
+    @when(AST.While)
+    def visit(self, node: AST.While):
+        self.enter(node.scope, node.line)
+        self.emit(f'while {node.cond.accept(self)}:', node.line)
+        self.loop_depth += 1
+        self.block(node.instr)
+        self.loop_depth -= 1
+
+    @when(AST.For)
+    def visit(self, node: AST.For):
+        first, last = self.temp(), self.temp()
+        self.emit(f'{first} = {node.range.left.accept(self)}', node.line)
+        self.emit(f'{last} = {node.range.right.accept(self)}', node.line)
+        self.enter(node.scope, node.line)
+        symbols = node.var.binding.symbols
+        self.loop_depth += 1
+        if len(symbols) == 1 and node.counted:
+            # the counter is only advanced by the loop: iterate a native range
+            counter = self.name(symbols[0])
+            outlives_loop = symbols[0] is not node.scope.symbols[node.var.name]
+            if outlives_loop:
+                self.emit(f'{counter} = {first}', node.line)
+            self.emit(f'for {counter} in counted({first}, {last}):', node.line)
+            self.block(node.instr)
+            if outlives_loop:
+                self.emit('else:', node.line)
+                self.emit(f'    {counter} = after({first}, {last})', node.line)
+        else:
+            started = self.temp()
+            self.write(node.var.binding, first, node.line)
+            self.emit(f'{started} = False', node.line)
+            self.emit('while True:', node.line)
+            self.level += 1
+            self.emit(f'if {started}:', node.line)
+            self.level += 1
+            self.write(node.binding, f'{self.read(node.binding)} + 1', node.line)
+            self.level -= 1
+            self.emit(f'{started} = True', node.line)
+            self.emit(f'if not {self.read(node.binding)} <= {last}:', node.line)
+            self.emit('    break', node.line)
+            self.level -= 1
+            self.block(node.instr)
+        self.loop_depth -= 1
+
+    @when(AST.Return)
+    def visit(self, node: AST.Return):
+        self.emit(f'raise ReturnValueException({node.expression.accept(self)})', node.line)
+
+    @when(AST.Break)
+    def visit(self, node: AST.Break):
+        self.emit('break' if self.loop_depth else 'raise BreakException()', node.line)
+
+    @when(AST.Continue)
+    def visit(self, node: AST.Continue):
+        self.emit('continue' if self.loop_depth else 'raise ContinueException()', node.line)
+
+    @when(AST.Print)
+    def visit(self, node: AST.Print):
+        values = ', '.join(f'printable({value.accept(self)})' for value in node.to_print.values)
+        self.emit(f'print({values})', node.line)
+
+    @when(AST.Assignment)
+    def visit(self, node: AST.Assignment):
+        value = node.expression.accept(self)
+        operator = None if node.operator == '=' else node.operator[0]
+        if isinstance(node.var, AST.Var):
+            if operator is None and node.shares and not self.never_matrix(node.expression):
+                value = f'share({value})'
+            elif operator is not None and node.inplace and not self.never_matrix(node.var):
+                value = f'augment({operator!r}, {self.read(node.var.binding)}, {value})'
+            elif operator == '*':
+                value = self.product(node.var, node.expression, self.read(node.var.binding), value)
+            elif operator is not None:
+                value = self.binary(operator, self.read(node.var.binding), value)
+            self.write(node.var.binding, value, node.line)
+            return
+
+        target, matrix, element = self.temp(), self.temp(), self.temp()
+        self.emit(f'{target} = {matrix} = {node.var.id.accept(self)}', node.line)
+        if isinstance(node.var, AST.VectorRef):
+            region = self.index(node.var.index)
+        else:
+            region = f'{self.index(node.var.row_index)}, {self.index(node.var.col_index)}'
+        if isinstance(node.var, AST.VectorRef) and not isinstance(node.var.index, (AST.Number, AST.Range)):
+            # the index may be a mask, which assign tells at run time
+            self.emit(f'{matrix} = assign({matrix}, {region}, {value}, {operator!r})', node.line)
+        else:
+            if operator == '*':
+                value = self.product(None, node.expression, f'scalar({matrix}[{region}])', value)
+            elif operator is not None:
+                value = self.binary(operator, f'scalar({matrix}[{region}])', value)
+            self.emit(f'{element} = {value}', node.line)
+            self.emit(f'{matrix} = writable({matrix}, {element})', node.line)
+            self.emit(f'{matrix}[{region}] = {element}', node.line)
+        # storing a float into an int matrix, or into a shared one, copied it
+        self.emit(f'if {matrix} is not {target}:', node.line)
+        self.level += 1
+        self.write(node.var.id.binding, matrix, node.line)
+        self.level -= 1
+
+    def index(self, index):
+        if isinstance(index, AST.Range):
+            return f'{index.left.accept(self)}:{index.right.accept(self)}'
+        return index.accept(self)
+
+    @when(AST.Matrix)
+    def visit(self, node: AST.Matrix):
+        return 'array([' + ', '.join(row.accept(self) for row in node.matrix) + '])'
+
+    @when(AST.Vector)
+    def visit(self, node: AST.Vector):
+        return 'array([' + ', '.join(element.accept(self) for element in node.vector) + '])'
+
+    @when(AST.VectorRef)
+    def visit(self, node: AST.VectorRef):
+        vector = node.id.accept(self)
+        if isinstance(node.index, AST.Range):
+            return f'{vector}[{node.index.left.accept(self)}:{node.index.right.accept(self)}].copy()'
+        return f'item({vector}, {node.index.accept(self)})'
+
+    @when(AST.MatrixRef)
+    def visit(self, node: AST.MatrixRef):
+        matrix = node.id.accept(self)
+        if isinstance(node.row_index, AST.Range) or isinstance(node.col_index, AST.Range):
+            return f'submatrix({matrix}, {self.index_range(node.row_index)}, {self.index_range(node.col_index)})'
+        return f'scalar({matrix}[{node.row_index.accept(self)}, {node.col_index.accept(self)}])'
+
+    def index_range(self, index):
+        if isinstance(index, AST.Range):
+            return f'range({index.left.accept(self)}, {index.right.accept(self)})'
+        return f'[{index.accept(self)}]'
+
+    @when(AST.MatrixFunction)
+    def visit(self, node: AST.MatrixFunction):
+        args = ', '.join(arg.accept(self) for arg in node.args)
+        return f'matrix_creators[{node.name!r}]([{args}])'
+
+    @when(AST.FunctionCall)
+    def visit(self, node: AST.FunctionCall):
+        args = ', '.join(f'sequence({arg.left.accept(self)}, {arg.right.accept(self)})'
+                         if isinstance(arg, AST.Range) else arg.accept(self) for arg in node.args)
+        return f'functions[{node.name!r}].function([{args}])'
@@ -0,0 +1,358 @@
+import AST
+from functools import partial
+from Memory import *
+from Exceptions import *
+from visit import *
+import numpy as np
+from Interpreter import operations, negate, matrix_creators, scalar, submatrix, assign, augment, share
+from Interpreter import item, transpose, printable
+from Resolver import Resolver
+from Fusion import evaluate
+from Builtins import functions, sequence
+
+
+# Compiles a program once into nested closures taking the FrameStack.
+# Literals are decoded, operators looked up and variables resolved to their
+# frame slots at compile time, so running a loop only calls the closures of
+# its body.
+class Compiler(object):
+    def __init__(self, operations=operations):
+        self.operations = operations
+
+    def compile(self, node):
+        return node.accept(self)
+
+    def run(self, node):
+        Resolver().resolve(node)
+        memory = FrameStack()
+        memory.push(node.scope)
+        signal = self.compile(node)(memory)
+        if signal is not None:
+            raise_signal(signal)
+        return memory
+
+    @on('node')
+    def visit(self, node):
+        pass
+
+    @when(AST.Instructions)
+    def visit(self, node: AST.Instructions):
+        instructions = tuple(instruction.accept(self) for instruction in node.instructions)
+        if len(instructions) == 1:
+            return instructions[0]
+
+        def run(memory):
+            for instruction in instructions:
+                signal = instruction(memory)
+                if signal is not None:
+                    return signal
+        return run
+
+    @when(AST.BinaryExpression)
+    def visit(self, node: AST.BinaryExpression):
+        return self.binary(self.operations[node.operator], node.left, node.right)
+
+    @when(AST.Condition)
+    def visit(self, node: AST.Condition):
+        return self.binary(self.operations[node.operator], node.left, node.right)
+
+    def binary(self, op, left, right):
+        # literal operands are bound as values instead of constant closures
+        if isinstance(right, AST.Number):
+            left, right = left.accept(self), right.constant
+            return lambda memory: op(left(memory), right)
+        if isinstance(left, AST.Number):
+            left, right = left.constant, right.accept(self)
+            return lambda memory: op(left, right(memory))
+        left, right = left.accept(self), right.accept(self)
+        return lambda memory: op(left(memory), right(memory))
+
+    @when(AST.Uminus)
+    def visit(self, node: AST.Uminus):
+        right = node.right.accept(self)
+        return lambda memory: negate(right(memory))
+
+    @when(AST.Transposition)
+    def visit(self, node: AST.Transposition):
+        matrix = node.matrix.accept(self)
+        return lambda memory: transpose(matrix(memory))
+
+    @when(AST.Elementwise)
+    def visit(self, node: AST.Elementwise):
+        tree = node.tree
+        leaves = tuple(leaf.accept(self) for leaf in node.leaves)
+        if node.dead is not None:
+            dead = self.load(node.dead)
+            return lambda memory: evaluate(tree, [leaf(memory) for leaf in leaves], dead(memory))
+        return lambda memory: evaluate(tree, [leaf(memory) for leaf in leaves])
+
+    @when(AST.Var)
+    def visit(self, node: AST.Var):
+        return self.load(node.binding)
+
+    @when(AST.Number)
+    def visit(self, node: AST.Number):
+        value = node.constant
+        return lambda memory: value
+
+    @when(AST.String)
+    def visit(self, node: AST.String):
+        value = str(node.string)[1:-1]
+        return lambda memory: value
+
+    @when(AST.If)
+    def visit(self, node: AST.If):
+        cond = node.cond.accept(self)
+        instr = self.block(node.instr, node.scope)
+
+        def run(memory):
+            if cond(memory):
+                return instr(memory)
+        return run
+
+    @when(AST.Ifelse)
+    def visit(self, node: AST.Ifelse):
+        cond = node.cond.accept(self)
+        instr = self.block(node.instr, node.scope)
+        instr_else = self.block(node.instr_else, node.else_scope)
+
+        def run(memory):
+            if cond(memory):
+                return instr(memory)
+            return instr_else(memory)
+        return run
+
+    def block(self, node, scope):
+        instr = node.accept(self)
+        if scope.elided:
+            return instr
+
+        def run(memory):
+            memory.push(scope)
+            try:
+                return instr(memory)
+            finally:
+                memory.pop()
+        return run
+
+    @when(AST.While)
+    def visit(self, node: AST.While):
+        cond = node.cond.accept(self)
+        instr = node.instr.accept(self)
+
+        elided = node.scope.elided
+
+        def run(memory):
+            if not elided:
+                memory.push(node.scope)
+            try:
+                while cond(memory):
+                    signal = instr(memory)
+                    if signal is not None and signal is not CONTINUE:
+                        if signal is BREAK:
+                            break
+                        return signal
+            finally:
+                if not elided:
+                    memory.pop()
+        return run
+
+    @when(AST.For)
+    def visit(self, node: AST.For):
+        start = node.range.left.accept(self)
+        end = node.range.right.accept(self)
+        store = self.store(node.var.binding)
+        counters = node.binding.symbols
+        instr = node.instr.accept(self)
+        elided = node.scope.elided
+        counted, reads = node.counted, node.reads_counter
+
+        def count(memory, slots, i, first, last):
+            for value in range(first, last + 1):
+                if reads:
+                    slots[i] = value
+                signal = instr(memory)
+                if signal is not None and signal is not CONTINUE:
+                    slots[i] = value
+                    return None if signal is BREAK else signal
+            slots[i] = max(first, last + 1)
+            return None
+
+        def run(memory):
+            first, last = start(memory), end(memory)
+            if not elided:
+                memory.push(node.scope)
+            store(memory, first)
+            for counter in counters:
+                slots = memory.stack[counter.frame].slots
+                if slots[counter.slot] is not UNSET:
+                    break
+            i = counter.slot
+            try:
+                if counted and first.__class__ is int and last.__class__ is int:
+                    return count(memory, slots, i, first, last)
+                while slots[i] <= last:
+                    signal = instr(memory)
+                    if signal is not None and signal is not CONTINUE:
+                        if signal is BREAK:
+                            break
+                        return signal
+                    slots[i] = slots[i] + 1
+            finally:
+                if not elided:
+                    memory.pop()
+        return run
+
+    @when(AST.Return)
+    def visit(self, node: AST.Return):
+        expression = node.expression.accept(self)
+        return lambda memory: ReturnValue(expression(memory))
+
+    @when(AST.Break)
+    def visit(self, node: AST.Break):
+        return lambda memory: BREAK
+
+    @when(AST.Continue)
+    def visit(self, node: AST.Continue):
+        return lambda memory: CONTINUE
+
+    @when(AST.Print)
+    def visit(self, node: AST.Print):
+        values = tuple(element.accept(self) for element in node.to_print.values)
+
+        def run(memory):
+            print(*[printable(value(memory)) for value in values], sep=' ')
+        return run
+
+    @when(AST.Assignment)
+    def visit(self, node: AST.Assignment):
+        op = None if node.operator == '=' else self.operations[node.operator[0]]
+        if isinstance(node.var, AST.Var):
+            if op is None:
+                expression = node.expression.accept(self)
+                if node.shares:
+                    value = expression
+                    expression = lambda memory: share(value(memory))
+            elif node.inplace:
+                expression = self.binary(partial(augment, node.operator[0]), node.var, node.expression)
+            else:
+                expression = self.binary(op, node.var, node.expression)
+            symbols = node.var.binding.symbols
+            if len(symbols) == 1:
+                frame, slot = symbols[0].frame, symbols[0].slot
+
+                def run(memory):
+                    memory.stack[frame].slots[slot] = expression(memory)
+                return run
+            store = self.store(node.var.binding)
+            return lambda memory: store(memory, expression(memory))
+
+        expression = node.expression.accept(self)
+
+        load = self.load(node.var.id.binding)
+        store = self.store(node.var.id.binding)
+        if isinstance(node.var, AST.VectorRef):
+            region = self.index(node.var.index)
+        else:
+            rows, cols = self.index(node.var.row_index), self.index(node.var.col_index)
+            region = lambda memory: (rows(memory), cols(memory))
+
+        operator = None if node.operator == '=' else node.operator[0]
+
+        def run(memory):
+            target = load(memory)
+            matrix = assign(target, region(memory), expression(memory), operator)
+            if matrix is not target:
+                store(memory, matrix)
+        return run
+
+    def index(self, index):
+        if isinstance(index, AST.Range):
+            left = index.left.accept(self)
+            right = index.right.accept(self)
+            return lambda memory: slice(left(memory), right(memory))
+        return index.accept(self)
+
+    def index_range(self, index):
+        if isinstance(index, AST.Range):
+            left = index.left.accept(self)
+            right = index.right.accept(self)
+            return lambda memory: range(left(memory), right(memory))
+        value = index.accept(self)
+        return lambda memory: [value(memory)]
+
+    def load(self, binding):
+        symbols = binding.symbols
+        if binding.static:
+            frame, slot = symbols[0].frame, symbols[0].slot
+            return lambda memory: memory.stack[frame].slots[slot]
+
+        def run(memory):
+            stack = memory.stack
+            for symbol in symbols:
+                value = stack[symbol.frame].slots[symbol.slot]
+                if value is not UNSET:
+                    return value
+            return None
+        return run
+
+    def store(self, binding):
+        symbols = binding.symbols
+
+        def run(memory, value):
+            stack = memory.stack
+            for symbol in symbols[:-1]:
+                slots = stack[symbol.frame].slots
+                if slots[symbol.slot] is not UNSET:
+                    slots[symbol.slot] = value
+                    return
+            stack[symbols[-1].frame].slots[symbols[-1].slot] = value
+        return run
+
+    @when(AST.Matrix)
+    def visit(self, node: AST.Matrix):
+        rows = tuple(row.accept(self) for row in node.matrix)
+        return lambda memory: np.array([row(memory) for row in rows])
+
+    @when(AST.Vector)
+    def visit(self, node: AST.Vector):
+        elements = tuple(element.accept(self) for element in node.vector)
+        return lambda memory: np.array([element(memory) for element in elements])
+
+    @when(AST.VectorRef)
+    def visit(self, node: AST.VectorRef):
+        load = self.load(node.id.binding)
+        if isinstance(node.index, AST.Range):
+            left = node.index.left.accept(self)
+            right = node.index.right.accept(self)
+            return lambda memory: load(memory)[left(memory):right(memory)].copy()
+        index = node.index.accept(self)
+        return lambda memory: item(load(memory), index(memory))
+
+    @when(AST.MatrixRef)
+    def visit(self, node: AST.MatrixRef):
+        load = self.load(node.id.binding)
+        rows = self.index_range(node.row_index)
+        cols = self.index_range(node.col_index)
+        if isinstance(node.row_index, AST.Range) or isinstance(node.col_index, AST.Range):
+            return lambda memory: submatrix(load(memory), rows(memory), cols(memory))
+        return lambda memory: scalar(load(memory)[rows(memory)[0], cols(memory)[0]])
+
+    @when(AST.MatrixFunction)
+    def visit(self, node: AST.MatrixFunction):
+        create = matrix_creators[node.name]
+        args = tuple(arg.accept(self) for arg in node.args)
+        return lambda memory: create([arg(memory) for arg in args])
+
+    @when(AST.FunctionCall)
+    def visit(self, node: AST.FunctionCall):
+        function = functions[node.name].function
+        args = tuple(self.argument(arg) for arg in node.args)
+        return lambda memory: function([arg(memory) for arg in args])
+
+    def argument(self, arg):
+        if isinstance(arg, AST.Range):
+            left = arg.left.accept(self)
+            right = arg.right.accept(self)
+            return lambda memory: sequence(left(memory), right(memory))
+        return arg.accept(self)
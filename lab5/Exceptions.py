@@ -9,4 +9,27 @@ class BreakException(Exception):
 
 
 class ContinueException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+# Non-raising control signals: statements in the interpreter and the closure
+# engine return None when they complete normally, BREAK, CONTINUE or a
+# ReturnValue record, and every enclosing block hands the signal up until a
+# loop or the program consumes it.
+class ReturnValue(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+BREAK = object()
+CONTINUE = object()
+
+
+def raise_signal(signal):
+    # a signal that leaves the program surfaces as the matching exception
+    if signal is BREAK:
+        raise BreakException()
+    if signal is CONTINUE:
+        raise ContinueException()
+    raise ReturnValueException(signal.value)
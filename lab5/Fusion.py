@@ -0,0 +1,118 @@
+import numpy as np
+
+import AST
+from Pool import pool
+from Resolver import fields
+
+elementwise_operators = {'.+', '.-', '.*', './'}
+
+ufuncs = {
+    '.+': np.add,
+    '.-': np.subtract,
+    '.*': np.multiply,
+    './': np.true_divide,
+    '-': np.negative,
+}
+
+# elements of a matrix evaluated together, small enough for every
+# intermediate chunk of a tree to stay in cache
+CHUNK = 1 << 15
+
+
+def is_elementwise(node):
+    return (isinstance(node, AST.Uminus) or
+            isinstance(node, AST.BinaryExpression) and node.operator in elementwise_operators)
+
+
+def fuse(node):
+    # replaces every maximal tree of element-wise operations, other than a
+    # lone unary minus, with an Elementwise node when one of its leaves is
+    # a matrix; returns the node that takes node's place. Trees of numbers
+    # are left alone, so ints stay Python ints
+    if isinstance(node, list):
+        return [fuse(value) for value in node]
+    if not isinstance(node, AST.Node):
+        return node
+    if is_elementwise(node) and (isinstance(node, AST.BinaryExpression) or is_elementwise(node.right)) and \
+            any(leaf.type in ('matrix', 'vector', 'mask') for leaf in tree_leaves(node)):
+        leaves = []
+        tree = describe(node, leaves)
+        return AST.Elementwise(tree, leaves, line=node.line)
+    for name in fields(node):
+        setattr(node, name, fuse(getattr(node, name)))
+    return node
+
+
+def operands(node):
+    return [node.right] if isinstance(node, AST.Uminus) else [node.left, node.right]
+
+
+def tree_leaves(node):
+    if not is_elementwise(node):
+        return [node]
+    return [leaf for operand in operands(node) for leaf in tree_leaves(operand)]
+
+
+def describe(node, leaves):
+    if not is_elementwise(node):
+        leaves.append(fuse(node))
+        return len(leaves) - 1
+    operator = '-' if isinstance(node, AST.Uminus) else node.operator
+    return (operator,) + tuple(describe(operand, leaves) for operand in operands(node))
+
+
+def evaluate(tree, leaves, dead=None):
+    # runs the tree over row chunks of its matrix operands, writing the
+    # result of each chunk straight into the one output matrix; operands of
+    # different shapes, or no matrix at all, take the plain numpy path.
+    # dead is the old value of the variable the result is assigned to, when
+    # the Resolver proved nothing else refers to it
+    arrays = [leaf for leaf in leaves if leaf.__class__ is np.ndarray]
+    if not arrays or arrays[0].ndim == 0 or len(arrays[0]) == 0 or \
+            any(array.shape != arrays[0].shape for array in arrays):
+        output = apply(tree, leaves)
+        if dead.__class__ is np.ndarray:
+            pool.give(dead)
+        # a numpy scalar would wrap around where a Python int grows
+        return output.item() if isinstance(output, np.generic) else output
+    shape = arrays[0].shape
+    # the first row tells the type of the result
+    head = [leaf[:1] if leaf.__class__ is np.ndarray else leaf for leaf in leaves]
+    # rows written to the old value must not be read again through a view
+    # of it, a transposition of the variable being assigned
+    reusable = dead.__class__ is np.ndarray and \
+        not any(array is not dead and np.may_share_memory(array, dead) for array in arrays)
+    output = pool.result(dead if reusable else None, shape, apply(tree, head).dtype)
+    if all(operand.__class__ is int for operand in tree[1:]):
+        # a single operation has no intermediates to keep in cache
+        ufuncs[tree[0]](*[leaves[operand] for operand in tree[1:]], out=output)
+    else:
+        step = max(1, CHUNK // (arrays[0].size // shape[0] or 1))
+        buffers = {}
+        for start in range(0, shape[0], step):
+            rows = slice(start, start + step)
+            chunk = [leaf[rows] if leaf.__class__ is np.ndarray else leaf for leaf in leaves]
+            apply(tree, chunk, buffers, output[rows])
+    if dead.__class__ is np.ndarray and dead is not output:
+        pool.give(dead)
+    return output
+
+
+def apply(tree, values, buffers=None, out=None):
+    if tree.__class__ is int:
+        return values[tree]
+    function = ufuncs[tree[0]]
+    arguments = [apply(operand, values, buffers) for operand in tree[1:]]
+    if buffers is None:
+        return function(*arguments)
+    if out is None:
+        buffer = buffers.get(tree)
+        if buffer is None:
+            buffers[tree] = function(*arguments)
+            return buffers[tree]
+        if buffer.__class__ is not np.ndarray:
+            # a subtree of scalars only
+            return function(*arguments)
+        rows = max(len(argument) for argument in arguments if argument.__class__ is np.ndarray)
+        out = buffer[:rows]
+    return function(*arguments, out=out)
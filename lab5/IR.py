@@ -0,0 +1,662 @@
+import AST
+from Resolver import Resolver
+from TypeChecker import NodeVisitor
+
+# instructions that end a block; jump and branch name their targets, return
+# and a break or continue outside any loop leave the program
+terminators = {'jump', 'branch', 'return'}
+
+# instructions that write a variable, each defining a new version of it
+definitions = {'set', 'maybe', 'undef', 'phi'}
+
+
+# An SSA value: op applied to args, which are the instructions defining the
+# values used, so every use points straight at its definition; users is the
+# other direction, the instructions using this one. node is the AST node the
+# instruction was lowered from, a statement or the expression it computes,
+# statement the statement it is part of and line its source line.
+# Instructions that define a variable version carry its symbol, the
+# Resolver's VariableSymbol.
+class Instruction(object):
+    def __init__(self, op, args, node=None, line=0, statement=None, **attributes):
+        self.op = op
+        self.args = args
+        self.node = node
+        self.line = line
+        self.statement = statement
+        self.type = getattr(node, 'type', None)
+        self.symbol = None
+        self.block = None
+        self.users = []
+        self.name = None
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return self.name or self.op
+
+
+class Block(object):
+    def __init__(self, index):
+        self.index = index
+        self.phis = []
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+        # the immediate dominator, the blocks it immediately dominates and
+        # the dominance frontier
+        self.idom = None
+        self.children = []
+        self.frontier = set()
+        self.depth = 0
+
+    @property
+    def terminator(self):
+        if self.instructions and self.instructions[-1].op in terminators:
+            return self.instructions[-1]
+        return None
+
+    @property
+    def line(self):
+        for instruction in self.phis + self.instructions:
+            if instruction.line:
+                return instruction.line
+        return 0
+
+    def __repr__(self):
+        return f'b{self.index}'
+
+
+def reverse_postorder(entry):
+    order, seen = [], {entry}
+    stack = [(entry, iter(entry.successors))]
+    while stack:
+        block, successors = stack[-1]
+        for successor in successors:
+            if successor not in seen:
+                seen.add(successor)
+                stack.append((successor, iter(successor.successors)))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+
+def increment(value, phi):
+    # the constant the value adds to phi, or None when it is not phi plus or
+    # minus an int constant
+    if value.op == 'set':
+        value = value.args[0]
+    if value.op != 'binary' or value.operator not in '+-':
+        return None
+    left, right = value.args
+    if value.operator == '+' and left.op == 'const' and right is phi:
+        left, right = right, left
+    if left is not phi or right.op != 'const' or right.value.__class__ is not int:
+        return None
+    return right.value if value.operator == '+' else -right.value
+
+
+def trip_count(start, step, operator, bound):
+    # iterations of a loop while counter <operator> bound, the counter going
+    # from start by step; None when it would not stop
+    if operator in ('<=', '>='):
+        operator, bound = operator[0], bound + (1 if operator == '<=' else -1)
+    if operator == '<' and step > 0:
+        return max(0, (bound - start + step - 1) // step)
+    if operator == '>' and step < 0:
+        return max(0, (start - bound - step - 1) // -step)
+    return None
+
+
+# A loop of the graph: its header and the blocks that reach a back edge to
+# the header without passing through it, for every back edge, so the blocks
+# a continue jumps back from are part of it. node is the While or For it
+# was lowered from. inductions maps the basic induction variables, header
+# phis that every back edge brings back increased by the same int constant,
+# to (initial, step), initial being the version the loop is entered with.
+# trips is the number of iterations when the condition compares one of
+# them to a constant and it starts from a constant, None otherwise; a
+# break may leave the loop sooner.
+class NaturalLoop(object):
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}
+        self.node = header.terminator.node
+        self.inductions = {}
+        self.trips = None
+
+    def analyze(self):
+        header = self.header
+        for phi in header.phis:
+            initial, steps = [], set()
+            for predecessor, arg in zip(header.predecessors, phi.args):
+                if predecessor in self.blocks:
+                    steps.add(increment(arg, phi))
+                else:
+                    initial.append(arg)
+            if len(initial) == 1 and len(steps) == 1 and None not in steps:
+                self.inductions[phi] = (initial[0], steps.pop())
+        branch = header.terminator
+        if branch.op != 'branch' or branch.args[0].op != 'compare' or branch.targets[0] not in self.blocks:
+            return
+        condition = branch.args[0]
+        counter, bound = condition.args
+        operator = condition.operator
+        if bound in self.inductions:
+            counter, bound = bound, counter
+            operator = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}.get(operator)
+        if counter not in self.inductions or bound.op != 'const' or bound.value.__class__ is not int:
+            return
+        initial, step = self.inductions[counter]
+        if initial.op == 'set':
+            initial = initial.args[0]
+        if initial.op == 'const' and initial.value.__class__ is int:
+            self.trips = trip_count(initial.value, step, operator, bound.value)
+
+
+# The control-flow graph of a program in SSA form. Every variable symbol the
+# Resolver found is a separate SSA variable, so names shadowed in a block
+# scope never mix; entering a scope defines its symbols as undef. blocks
+# holds the blocks reachable from entry in reverse postorder, code after a
+# break, continue or return is not among them. values maps every AST
+# expression that was lowered to the instruction giving its value, a
+# variable read to the version it reads.
+class Graph(object):
+    def __init__(self, program):
+        self.program = program
+        self.created = []
+        self.entry = self.block()
+        self.exit = self.block()
+        self.blocks = []
+        self.values = {}
+
+    def block(self):
+        block = Block(len(self.created))
+        self.created.append(block)
+        return block
+
+    def instructions(self):
+        for block in self.blocks:
+            yield from block.phis
+            yield from block.instructions
+
+    def dominates(self, a, b):
+        while b.depth > a.depth:
+            b = b.idom
+        return a is b
+
+    def loops(self):
+        loops = {}
+        for block in self.blocks:
+            for header in block.successors:
+                if self.dominates(header, block):
+                    loop = loops.setdefault(header, NaturalLoop(header))
+                    work = [block]
+                    while work:
+                        member = work.pop()
+                        if member not in loop.blocks:
+                            loop.blocks.add(member)
+                            work.extend(member.predecessors)
+        for loop in loops.values():
+            loop.analyze()
+        return list(loops.values())
+
+    def build(self):
+        self.prune()
+        self.dominators()
+        self.frontiers()
+        self.rename(self.place_phis())
+        self.chain()
+        self.number()
+        return self
+
+    def prune(self):
+        self.blocks = reverse_postorder(self.entry)
+        reachable = set(self.blocks)
+        for block in self.blocks:
+            block.predecessors = [p for p in block.predecessors if p in reachable]
+        for position, block in enumerate(self.blocks):
+            block.order = position
+
+    def dominators(self):
+        # Cooper, Harvey and Kennedy's iteration over reverse postorder
+        entry = self.entry
+        entry.idom = entry
+        changed = True
+        while changed:
+            changed = False
+            for block in self.blocks[1:]:
+                processed = [p for p in block.predecessors if p.idom is not None]
+                idom = processed[0]
+                for other in processed[1:]:
+                    idom = self.intersect(idom, other)
+                if block.idom is not idom:
+                    block.idom = idom
+                    changed = True
+        entry.idom = None
+        for block in self.blocks[1:]:
+            block.idom.children.append(block)
+            block.depth = block.idom.depth + 1
+
+    def intersect(self, a, b):
+        while a is not b:
+            while a.order > b.order:
+                a = a.idom
+            while b.order > a.order:
+                b = b.idom
+        return a
+
+    def frontiers(self):
+        for block in self.blocks:
+            if len(block.predecessors) > 1:
+                for predecessor in block.predecessors:
+                    runner = predecessor
+                    while runner is not block.idom:
+                        runner.frontier.add(block)
+                        runner = runner.idom
+
+    def place_phis(self):
+        # a phi for a symbol at the iterated dominance frontier of the blocks
+        # defining it
+        defining = {}
+        for block in self.blocks:
+            for instruction in block.instructions:
+                if instruction.op in definitions:
+                    defining.setdefault(instruction.symbol, set()).add(block)
+        phis = {}
+        for symbol, blocks in defining.items():
+            work, placed = list(blocks), set()
+            while work:
+                for block in work.pop().frontier:
+                    if block not in placed:
+                        placed.add(block)
+                        phi = Instruction('phi', [None] * len(block.predecessors), line=block.line, symbol=symbol)
+                        phi.block = block
+                        block.phis.append(phi)
+                        phis[phi] = symbol
+                        if block not in blocks:
+                            work.append(block)
+        return phis
+
+    def rename(self, phis):
+        # a walk of the dominator tree keeping the current version of every
+        # symbol; reads, lowered as get, are replaced by the version they see
+        current = {}
+        replaced = {}
+        stack = [(self.entry, None)]
+        while stack:
+            block, saved = stack.pop()
+            if saved is not None:
+                current.update(saved)
+                continue
+            saved = {}
+            for phi in block.phis:
+                saved.setdefault(phi.symbol, current.get(phi.symbol))
+                current[phi.symbol] = phi
+            kept = []
+            for instruction in block.instructions:
+                instruction.args = [replaced.get(arg, arg) for arg in instruction.args]
+                if instruction.op == 'get':
+                    replaced[instruction] = current[instruction.symbol]
+                    continue
+                if instruction.op in definitions:
+                    saved.setdefault(instruction.symbol, current.get(instruction.symbol))
+                    current[instruction.symbol] = instruction
+                kept.append(instruction)
+            block.instructions = kept
+            for successor in block.successors:
+                for position, predecessor in enumerate(successor.predecessors):
+                    if predecessor is block:
+                        for phi in successor.phis:
+                            phi.args[position] = current[phi.symbol]
+            stack.append((block, saved))
+            stack.extend((child, None) for child in reversed(block.children))
+        for node, value in self.values.items():
+            self.values[node] = replaced.get(value, value)
+        self.prune_phis(phis)
+
+    def prune_phis(self, phis):
+        # phis nothing but other phis reads, of symbols out of scope at the
+        # join, say, are dropped
+        used = set()
+        work = [instruction for block in self.blocks for instruction in block.instructions]
+        while work:
+            for arg in work.pop().args:
+                if arg.__class__ is Instruction and arg.op == 'phi' and arg not in used:
+                    used.add(arg)
+                    work.append(arg)
+        for block in self.blocks:
+            block.phis = [phi for phi in block.phis if phi in used]
+
+    def chain(self):
+        for instruction in self.instructions():
+            instruction.users = []
+        for instruction in self.instructions():
+            for arg in instruction.args:
+                if arg.__class__ is Instruction:
+                    arg.users.append(instruction)
+
+    def number(self):
+        versions = {}
+        temporary = 0
+        for instruction in self.instructions():
+            if instruction.symbol is not None:
+                name = instruction.symbol.name
+                instruction.name = f'{name}.{versions.get(name, 0)}'
+                versions[name] = versions.get(name, 0) + 1
+            elif instruction.users:
+                instruction.name = f'%{temporary}'
+                temporary += 1
+
+    def dump(self, file=None):
+        for block in self.blocks:
+            predecessors = ', '.join(map(repr, block.predecessors))
+            idom = f', idom {block.idom}' if block.idom is not None else ''
+            print(f'{block}:  ; preds {predecessors or "-"}{idom}', file=file)
+            for instruction in block.phis + block.instructions:
+                print(f'    {describe(instruction):<40} ; line {instruction.line}', file=file)
+        for loop in self.loops():
+            inductions = ', '.join(f'{phi} += {step}' for phi, (initial, step) in loop.inductions.items())
+            trips = f', {loop.trips} trips' if loop.trips is not None else ''
+            print(f'; loop {loop.header}: {len(loop.blocks)} blocks{trips}, inductions {inductions or "-"}', file=file)
+
+
+def describe(instruction):
+    attributes = [str(getattr(instruction, name)) for name in ('operator', 'function', 'value')
+                  if hasattr(instruction, name)]
+    if instruction.op == 'phi':
+        operands = [f'[{block}: {arg}]' for block, arg in zip(instruction.block.predecessors, instruction.args)]
+    else:
+        operands = [repr(arg) for arg in instruction.args]
+    operands += [repr(target) for target in getattr(instruction, 'targets', ())]
+    text = ' '.join([instruction.op] + attributes) + (' ' + ', '.join(operands) if operands else '')
+    return f'{instruction.name} = {text}' if instruction.name else text
+
+
+def lower(program):
+    # the graph of a type-checked program; the Resolver runs first to bind
+    # every variable access to its symbols
+    scopes = Resolver().resolve(program)
+    graph = Graph(program)
+    Lowering(graph).lower(program, scopes)
+    return graph.build()
+
+
+class Loop(object):
+    def __init__(self, header, exit):
+        self.header = header
+        self.exit = exit
+
+
+# Lowers statements into the blocks of a Graph and expressions into three
+# address instructions; variable reads become get and writes set, which the
+# Graph renames into SSA form once the blocks are complete.
+class Lowering(NodeVisitor):
+    def __init__(self, graph):
+        super().__init__()
+        self.graph = graph
+        self.block = graph.entry
+        self.loops = []
+        self.line = 0
+        self.current = None
+
+    def lower(self, program, scopes):
+        # every symbol has a version from the start, undef until written
+        self.undefine(scopes)
+        self.statements(program)
+        self.jump(self.graph.exit)
+
+    def emit(self, op, args=(), node=None, **attributes):
+        line = getattr(node, 'line', 0) or self.line
+        instruction = Instruction(op, list(args), node, line, self.current, **attributes)
+        instruction.block = self.block
+        self.block.instructions.append(instruction)
+        return instruction
+
+    def value(self, node, instruction):
+        self.graph.values[node] = instruction
+        return instruction
+
+    def link(self, target):
+        self.block.successors.append(target)
+        target.predecessors.append(self.block)
+
+    def jump(self, target, node=None):
+        self.emit('jump', node=node, targets=[target])
+        self.link(target)
+        self.block = self.graph.block()
+
+    def branch(self, condition, then, otherwise, node):
+        self.emit('branch', [condition], node, targets=[then, otherwise])
+        self.link(then)
+        self.link(otherwise)
+
+    def leave(self, op, args, node):
+        self.emit(op, args, node, targets=[self.graph.exit])
+        self.link(self.graph.exit)
+        self.block = self.graph.block()
+
+    def undefine(self, scopes):
+        for scope in scopes:
+            for symbol in scope.symbols.values():
+                self.emit('undef', symbol=symbol)
+
+    def read(self, binding):
+        gets = [self.emit('get', symbol=symbol) for symbol in binding.symbols]
+        if len(gets) == 1:
+            return gets[0]
+        # the first of the candidate scopes holding the name
+        return self.emit('first', gets)
+
+    def write(self, binding, value, node):
+        symbols = binding.symbols
+        if len(symbols) == 1:
+            self.emit('set', [value], node, symbol=symbols[0])
+            return
+        # the value goes to whichever candidate holds the name, the others
+        # keep what they had
+        for symbol in symbols:
+            self.emit('maybe', [value, self.emit('get', symbol=symbol)], node, symbol=symbol)
+
+    def statements(self, instructions):
+        if isinstance(instructions, list):
+            for instruction in instructions:
+                self.statement(instruction)
+        elif instructions is not None:
+            self.statement(instructions)
+
+    def statement(self, node):
+        outer = self.current, self.line
+        self.current, self.line = node, node.line
+        self.visit(node)
+        self.current, self.line = outer
+
+    def generic_visit(self, node):
+        pass
+
+    def visit_Instructions(self, node: AST.Instructions):
+        self.statements(node.instructions)
+
+    def visit_Assignment(self, node: AST.Assignment):
+        if isinstance(node.var, AST.Var):
+            if node.operator == '=':
+                value = self.visit(node.expression)
+            else:
+                target = self.read(node.var.binding)
+                value = self.emit('binary', [target, self.visit(node.expression)], node, operator=node.operator[0])
+            self.write(node.var.binding, value, node)
+            return
+        matrix = self.read(node.var.id.binding)
+        if isinstance(node.var, AST.VectorRef):
+            indices = [self.index(node.var.index)]
+        else:
+            indices = [self.index(node.var.row_index), self.index(node.var.col_index)]
+        value = self.visit(node.expression)
+        operator = None if node.operator == '=' else node.operator[0]
+        stored = self.emit('store', [matrix] + indices + [value], node, operator=operator)
+        self.write(node.var.id.binding, stored, node)
+
+    def index(self, index):
+        if isinstance(index, AST.Range):
+            return self.visit_Range(index)
+        return self.visit(index)
+
+    def visit_Print(self, node: AST.Print):
+        self.emit('print', [self.visit(value) for value in node.to_print.values], node)
+
+    def visit_If(self, node: AST.If):
+        then, after = self.graph.block(), self.graph.block()
+        self.branch(self.visit(node.cond), then, after, node)
+        self.block = then
+        self.undefine([node.scope])
+        self.statements(node.instr)
+        self.jump(after)
+        self.block = after
+
+    def visit_Ifelse(self, node: AST.Ifelse):
+        then, otherwise, after = self.graph.block(), self.graph.block(), self.graph.block()
+        self.branch(self.visit(node.cond), then, otherwise, node)
+        self.block = then
+        self.undefine([node.scope])
+        self.statements(node.instr)
+        self.jump(after)
+        self.block = otherwise
+        self.undefine([node.else_scope])
+        self.statements(node.instr_else)
+        self.jump(after)
+        self.block = after
+
+    def visit_While(self, node: AST.While):
+        # the scope of a loop is entered once, its variables keep their
+        # values from one iteration to the next
+        header, body, exit = self.graph.block(), self.graph.block(), self.graph.block()
+        self.undefine([node.scope])
+        self.jump(header)
+        self.block = header
+        self.branch(self.visit(node.cond), body, exit, node)
+        self.loop(body, Loop(header, exit), node.instr)
+        self.block = exit
+
+    def visit_For(self, node: AST.For):
+        # the bounds are evaluated once, the counter goes up by one after
+        # every iteration, one past end when the loop runs out
+        start = self.visit(node.range.left)
+        end = self.visit(node.range.right)
+        header, body, latch, exit = self.graph.block(), self.graph.block(), self.graph.block(), self.graph.block()
+        self.undefine([node.scope])
+        self.write(node.var.binding, start, node)
+        self.jump(header)
+        self.block = header
+        counter = self.read(node.binding)
+        self.branch(self.emit('compare', [counter, end], node, operator='<='), body, exit, node)
+        self.loop(body, Loop(latch, exit), node.instr)
+        self.block = latch
+        step = self.emit('binary', [self.read(node.binding), self.emit('const', value=1)], node, operator='+')
+        self.write(node.binding, step, node)
+        self.jump(header)
+        self.block = exit
+
+    def loop(self, body, loop, instructions):
+        self.block = body
+        self.loops.append(loop)
+        self.statements(instructions)
+        self.loops.pop()
+        self.jump(loop.header)
+
+    def visit_Break(self, node: AST.Break):
+        if self.loops:
+            self.jump(self.loops[-1].exit, node)
+        else:
+            self.leave('return', [], node)
+
+    def visit_Continue(self, node: AST.Continue):
+        if self.loops:
+            self.jump(self.loops[-1].header, node)
+        else:
+            self.leave('return', [], node)
+
+    def visit_Return(self, node: AST.Return):
+        self.leave('return', [self.visit(node.expression)], node)
+
+    def visit_Var(self, node: AST.Var):
+        return self.value(node, self.read(node.binding))
+
+    def visit_Number(self, node: AST.Number):
+        return self.value(node, self.emit('const', node=node, value=node.constant))
+
+    def visit_IntNum(self, node: AST.IntNum):
+        return self.value(node, self.emit('const', node=node, value=int(node.intnum)))
+
+    def visit_Float(self, node: AST.Float):
+        return self.value(node, self.emit('const', node=node, value=float(node.floatnum)))
+
+    def visit_String(self, node: AST.String):
+        return self.value(node, self.emit('const', node=node, value=str(node.string)[1:-1]))
+
+    def visit_BinaryExpression(self, node: AST.BinaryExpression):
+        args = [self.visit(node.left), self.visit(node.right)]
+        return self.value(node, self.emit('binary', args, node, operator=node.operator))
+
+    def visit_Condition(self, node: AST.Condition):
+        args = [self.visit(node.left), self.visit(node.right)]
+        return self.value(node, self.emit('compare', args, node, operator=node.operator))
+
+    def visit_Uminus(self, node: AST.Uminus):
+        return self.value(node, self.emit('negate', [self.visit(node.right)], node))
+
+    def visit_Transposition(self, node: AST.Transposition):
+        return self.value(node, self.emit('transpose', [self.visit(node.matrix)], node))
+
+    def visit_Elementwise(self, node: AST.Elementwise):
+        leaves = [self.visit(leaf) for leaf in node.leaves]
+        return self.value(node, self.emit('elementwise', leaves, node, tree=node.tree))
+
+    def visit_Range(self, node: AST.Range):
+        args = [self.visit(node.left), self.visit(node.right)]
+        return self.value(node, self.emit('range', args, node))
+
+    def visit_Matrix(self, node: AST.Matrix):
+        return self.value(node, self.emit('matrix', [self.visit(row) for row in node.matrix], node))
+
+    def visit_Vector(self, node: AST.Vector):
+        return self.value(node, self.emit('vector', [self.visit(element) for element in node.vector], node))
+
+    def visit_VectorRef(self, node: AST.VectorRef):
+        args = [self.visit(node.id), self.index(node.index)]
+        return self.value(node, self.emit('index', args, node))
+
+    def visit_MatrixRef(self, node: AST.MatrixRef):
+        args = [self.visit(node.id), self.index(node.row_index), self.index(node.col_index)]
+        return self.value(node, self.emit('index', args, node))
+
+    def visit_MatrixFunction(self, node: AST.MatrixFunction):
+        args = [self.visit(arg) for arg in node.args]
+        return self.value(node, self.emit('create', args, node, function=node.name))
+
+    def visit_FunctionCall(self, node: AST.FunctionCall):
+        args = [self.visit(arg) for arg in node.args]
+        return self.value(node, self.emit('call', args, node, function=node.name))
+
+
+# Runs passes over the IR of a program. A pass has a name and run(graph),
+# which rewrites the program's tree through the AST nodes the instructions
+# were lowered from and returns the changes it made, (line, description)
+# pairs; every engine runs the rewritten tree. The graph is lowered again
+# after a pass that changed something, so each pass sees the program as it
+# is. report collects (pass name, line, description) for every change.
+class PassManager(object):
+    def __init__(self, passes=()):
+        self.passes = list(passes)
+        self.report = []
+
+    def run(self, program):
+        graph = lower(program)
+        for each in self.passes:
+            changes = each.run(graph)
+            self.report.extend((each.name, line, description) for line, description in changes)
+            if changes:
+                graph = lower(program)
+        return graph
@@ -1,16 +1,31 @@
 import AST
 import SymbolTable
 from Memory import *
+from Resolver import Resolver
+from Fusion import evaluate
+from Builtins import functions, sequence
+from Pool import pool
 from Exceptions import  *
 from visit import *
 import sys
+from collections import OrderedDict
 import numpy as np
 
 sys.setrecursionlimit(10000)
+
+
+def multiply(x, y):
+    # the matrix product when both operands are matrices, a vector is a row
+    if x.__class__ is np.ndarray and y.__class__ is np.ndarray:
+        product = np.matmul(np.atleast_2d(x), np.atleast_2d(y))
+        return product[0] if x.ndim == 1 else product
+    return x * y
+
+
 operations = {
             '+': lambda x, y: x + y,
             '-': lambda x, y: x - y,
-            '*': lambda x, y: x * y,
+            '*': multiply,
             '/': lambda x, y: x / y,
             '<': lambda x, y: x < y,
             '>': lambda x, y: x > y,
@@ -24,47 +39,242 @@ operations = {
             './': lambda x, y: mat_div(x, y)
         }
 
-def mat_add( a, b):
-    if isinstance(a[0], list):
-        return [[a[i][j] + b[i][j] for j in range(len(a[0]))] for i in range(len(a))]
-    return [a[i] + b[i] for i in range(len(a))]
+def mat_add(a, b):
+    return np.add(a, b)
 
 
 def mat_sub(a, b):
-    if isinstance(a[0], list):
-        return [[a[i][j] - b[i][j] for j in range(len(a[0]))] for i in range(len(a))]
-    return [a[i] - b[i] for i in range(len(a))]
+    return np.subtract(a, b)
 
 
-def mat_mul( a, b):
-    if isinstance(a[0], list):
-        return [[a[i][j] * b[i][j] for j in range(len(a[0]))] for i in range(len(a))]
-    return [a[i] * b[i] for i in range(len(a))]
+def mat_mul(a, b):
+    return np.multiply(a, b)
 
 
 def mat_div(a, b):
-    if isinstance(a[0], list):
-        return [[a[i][j] / b[i][j] for j in range(len(a[0]))] for i in range(len(a))]
-    return [a[i] / b[i] for i in range(len(a))]
+    return np.true_divide(a, b)
+
+
+def negate(value):
+    return -value
+
+
+def create_matrix(rows, cols, fill_value):
+    return np.full((rows, cols), fill_value)
+
+
+def create_identity_matrix(size):
+    return np.eye(size, dtype=int)
+
+
+def scalar(value):
+    # elements leave a matrix as plain Python numbers
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def item(vector, index):
+    # an element, a copy of a row of a matrix, or the elements under a mask
+    value = vector[index]
+    if value.__class__ is np.ndarray:
+        return value.copy() if value.base is not None else value
+    return scalar(value)
+
+
+def submatrix(matrix, rows, cols):
+    return matrix[np.ix_(rows, cols)]
+
+
+def transpose(value):
+    # a view with the strides swapped, nothing is copied; a vector, which is
+    # a row, becomes a one-column matrix
+    if value.__class__ is np.ndarray:
+        return np.atleast_2d(value).T
+    return value
+
+
+# matrices from this many elements up are copied tile by tile when their
+# layout differs from the copy's, so both tiles stay in cache
+TILED = 1 << 21
+TILE = 128
+
+
+def materialize(matrix, dtype=None):
+    # a copy in row-major order; a transposed view would read one column of
+    # its storage for every row written, which for large matrices misses
+    # the cache on nearly every element
+    dtype = matrix.dtype if dtype is None else dtype
+    if matrix.size < TILED or matrix.ndim != 2 or matrix.flags.c_contiguous:
+        return matrix.astype(dtype, order='C')
+    copy = np.empty(matrix.shape, dtype)
+    rows, cols = matrix.shape
+    for i in range(0, rows, TILE):
+        for j in range(0, cols, TILE):
+            copy[i:i + TILE, j:j + TILE] = matrix[i:i + TILE, j:j + TILE]
+    return copy
+
+
+def share(value):
+    # a matrix assigned to another variable is shared by both and becomes
+    # read-only, the first of them to write to it copies it; a view shares
+    # the storage of the matrix it looks into as well
+    if value.__class__ is np.ndarray:
+        value.flags.writeable = False
+        if value.base is not None:
+            value.base.flags.writeable = False
+    return value
+
+
+def exclusive(matrix):
+    # whether writing to the matrix changes nothing another variable sees
+    return matrix.flags.writeable and (matrix.base is None or matrix.base.flags.writeable)
+
+
+def writable(matrix, value):
+    # the matrix to store value in: a float copy of an int matrix when value
+    # is not an int, a copy of a shared one, or else the matrix itself
+    if matrix.dtype.kind == 'i' and np.asarray(value).dtype.kind != 'i':
+        return materialize(matrix, float)
+    if not exclusive(matrix):
+        return materialize(matrix)
+    return matrix
+
+
+inplace = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.true_divide,
+}
+
+
+def assign(matrix, region, value, operator=None):
+    # writes a scalar or a matrix of the region's shape in one array
+    # operation, returns the matrix, which is a new one if it was copied
+    if region.__class__ is np.ndarray and region.dtype.kind == 'b':
+        return assign_masked(matrix, region, value, operator)
+    if operator is not None:
+        value = operations[operator](scalar(matrix[region]), value)
+    matrix = writable(matrix, value)
+    matrix[region] = value
+    return matrix
+
+
+def assign_masked(matrix, mask, value, operator=None):
+    # the elements where mask holds take a scalar, or the elements of a
+    # matrix of the same shape at the same places, in one ufunc call
+    matrix = writable(matrix, 1.0 if operator == '/' else value)
+    if operator is None:
+        np.copyto(matrix, value, where=mask)
+    else:
+        inplace[operator](matrix, value, out=matrix, where=mask)
+    return matrix
+
+
+def augment(operator, target, value):
+    # op= on a matrix no other variable shares updates its storage in place
+    # when the result keeps its shape and type, the storage is otherwise dead
+    if target.__class__ is np.ndarray and exclusive(target) and \
+            not (operator == '*' and value.__class__ is np.ndarray):
+        dtype = np.result_type(target, value, 0.0) if operator == '/' else np.result_type(target, value)
+        if dtype == target.dtype and np.broadcast_shapes(target.shape, np.shape(value)) == target.shape:
+            return inplace[operator](target, value, out=target)
+    result = operations[operator](target, value)
+    if target.__class__ is np.ndarray and result is not target:
+        pool.give(target)
+    return result
+
+
+def printable(value):
+    # matrices print as the nested lists they used to be
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+class Constants(object):
+    # results of zeros, ones and eye, read-only and so shared by everything
+    # they are assigned to; once they take more than capacity bytes the
+    # least recently used are forgotten
+    def __init__(self, capacity=64 * 2 ** 20):
+        self.capacity = capacity
+        self.matrices = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key, create):
+        matrix = self.matrices.get(key)
+        if matrix is not None:
+            self.matrices.move_to_end(key)
+            return matrix
+        matrix = share(create())
+        if matrix.nbytes <= self.capacity:
+            self.matrices[key] = matrix
+            self.bytes += matrix.nbytes
+            while self.bytes > self.capacity:
+                self.bytes -= self.matrices.popitem(last=False)[1].nbytes
+        return matrix
+
+
+constants = Constants()
+
+
+def constant(create):
+    return lambda args: constants.get((create,) + tuple(args), lambda: create(args))
+
+
+matrix_creators = {
+    'zeros': constant(lambda args: create_matrix(args[0], args[1] if len(args) > 1 else args[0], 0)),
+    'ones': constant(lambda args: create_matrix(args[0], args[1] if len(args) > 1 else args[0], 1)),
+    'eye': constant(lambda args: create_identity_matrix(args[0]))
+}
 
 
 class Interpreter(object):
-    def __init__(self, operations):
+    def __init__(self, operations=operations, jit=None):
         self.operations = operations
+        self.memory = FrameStack()
+        self.jit = jit
+
+    def run(self, program):
+        # variables live in the slots the Resolver gave them, one frame per
+        # active scope, so reads and writes never search by name
+        Resolver().resolve(program)
+        self.memory = FrameStack()
+        self.memory.push(program.scope)
+        signal = program.accept(self)
+        if signal is not None:
+            raise_signal(signal)
+
+    def load(self, binding):
+        stack = self.memory.stack
+        for symbol in binding.symbols:
+            value = stack[symbol.frame].slots[symbol.slot]
+            if value is not UNSET:
+                return value
+        return None
+
+    def store(self, binding, value):
+        stack = self.memory.stack
+        symbols = binding.symbols
+        for symbol in symbols[:-1]:
+            slots = stack[symbol.frame].slots
+            if slots[symbol.slot] is not UNSET:
+                slots[symbol.slot] = value
+                return
+        symbol = symbols[-1]
+        stack[symbol.frame].slots[symbol.slot] = value
+
     @on('node')
     def visit(self, node):
         pass
 
     @when(AST.InstructionsOrEmpty)
     def visit(self, node: AST.Instructions):
-        self.memory = MemoryStack()
-        self.memory.push('global')
-        node.instructions.accept(self)
+        self.run(node.instructions)
 
     @when(AST.Instructions)
     def visit(self, node: AST.Instructions):
         for instruction in node.instructions:
-            instruction.accept(self)
+            signal = instruction.accept(self)
+            if signal is not None:
+                return signal
 
     @when(AST.BinaryExpression)
     def visit(self, node: AST.BinaryExpression):
@@ -81,20 +291,34 @@ class Interpreter(object):
 
     @when(AST.Uminus)
     def visit(self, node: AST.Uminus):
-        result = node.right.accept(self)
-        if isinstance(result, list):
-            if result and isinstance(result[0], list):
-                return [[-x for x in row] for row in result]
-            else:
-                return [-x for x in result]
-        else:
-            return -result
+        return negate(node.right.accept(self))
+
+    @when(AST.Elementwise)
+    def visit(self, node: AST.Elementwise):
+        leaves = [leaf.accept(self) for leaf in node.leaves]
+        return evaluate(node.tree, leaves, self.load(node.dead) if node.dead is not None else None)
+
+    @when(AST.Transposition)
+    def visit(self, node: AST.Transposition):
+        return transpose(node.matrix.accept(self))
 
     @when(AST.Id)
     def visit(self, node: AST.Id):
 
         return self.memory.get(node.name)
 
+    @when(AST.Var)
+    def visit(self, node: AST.Var):
+        binding = node.binding
+        if binding.static:
+            symbol = binding.symbols[0]
+            return self.memory.stack[symbol.frame].slots[symbol.slot]
+        return self.load(binding)
+
+    @when(AST.Number)
+    def visit(self, node: AST.Number):
+        return node.constant
+
     @when(AST.IntNum)
     def visit(self, node: AST.IntNum):
         return int(node.intnum)
@@ -105,157 +329,187 @@ class Interpreter(object):
 
     @when(AST.String)
     def visit(self, node: AST.String):
-        return str(node.string)
+        return str(node.string)[1:-1]
+
+    @when(AST.If)
+    def visit(self, node: AST.If):
+        if node.cond.accept(self):
+            return self.execute_block(node.instr, node.scope)
 
     @when(AST.Ifelse)
     def visit(self, node: AST.Ifelse):
         if node.cond.accept(self):
-            self.execute_block(node.instr, 'if')
+            return self.execute_block(node.instr, node.scope)
         elif node.instr_else is not None:
-            self.execute_block(node.instr_else, 'else')
+            return self.execute_block(node.instr_else, node.else_scope)
 
-    def execute_block(self, instructions, context_type):
-        self.memory.push(context_type)
+    def execute_block(self, instructions, scope):
+        if scope.elided:
+            return self.execute(instructions)
+        self.memory.push(scope)
         try:
-            if isinstance(instructions, AST.Instructions):
-                instructions.accept(self)
-            else:
-                for instruction in instructions:
-                    instruction.accept(self)
-        except BreakException as e:
-            raise e
+            return self.execute(instructions)
         finally:
             self.memory.pop()
 
+    def execute(self, instructions):
+        # runs statements until one of them returns a control signal
+        if not isinstance(instructions, list):
+            return instructions.accept(self)
+        for instruction in instructions:
+            signal = instruction.accept(self)
+            if signal is not None:
+                return signal
+        return None
+
     @when(AST.While)
     def visit(self, node: AST.While):
-        self.memory.push("while")
+        elided = node.scope.elided
+        if not elided:
+            self.memory.push(node.scope)
         try:
             while node.cond.accept(self):
-                try:
-                    if isinstance(node.instr, list):
-                        for instruction in node.instr:
-                            try:
-                                instruction.accept(self)
-                            except ContinueException:
-                                break
-                            except BreakException:
-                                raise
-                    else:
-                        try:
-                            node.instr.accept(self)
-                        except ContinueException:
-                            continue
-                        except BreakException:
-                            raise
-                except BreakException:
+                signal = self.execute(node.instr)
+                if signal is not None and signal is not CONTINUE:
+                    if signal is BREAK:
+                        break
+                    return signal
+                if self.jit is not None and self.jit.back_edge(node, self.memory.stack):
                     break
         finally:
-            self.memory.pop()
+            if not elided:
+                self.memory.pop()
 
     @when(AST.For)
-    def visit(self, node: AST.For, n: AST.Range):
-        iterator = node.var
-        start = n.left.accept(self)
-        end = n.right.accept(self)
-        self.memory.push("for")
-        self.memory.set(iterator.id, start)
+    def visit(self, node: AST.For):
+        start = node.range.left.accept(self)
+        end = node.range.right.accept(self)
+        elided = node.scope.elided
+        if not elided:
+            self.memory.push(node.scope)
+        self.store(node.var.binding, start)
+        for counter in node.binding.symbols:
+            slots = self.memory.stack[counter.frame].slots
+            if slots[counter.slot] is not UNSET:
+                break
+        i = counter.slot
         try:
-            while self.memory.get(iterator.id) <= end:
-                try:
-                    if isinstance(node.instr, list):
-                        for instruction in node.instr:
-                            try:
-                                instruction.accept(self)
-                            except ContinueException:
-                                break
-                            except BreakException:
-                                raise
-                    else:
-                        try:
-                            node.instr.accept(self)
-                        except ContinueException:
-                            continue
-                        except BreakException:
-                            raise
-                    self.memory.set(iterator.id, self.memory.get(iterator.id) + 1)
-                except BreakException:
+            if node.counted and start.__class__ is int and end.__class__ is int:
+                return self.count(node, slots, i, start, end)
+            while slots[i] <= end:
+                signal = self.execute(node.instr)
+                if signal is not None and signal is not CONTINUE:
+                    if signal is BREAK:
+                        break
+                    return signal
+                slots[i] = slots[i] + 1
+                if self.jit is not None and self.jit.back_edge(node, self.memory.stack, end):
                     break
         finally:
-            self.memory.pop()
-
+            if not elided:
+                self.memory.pop()
+
+    def count(self, node, slots, i, start, end):
+        # the counter runs in a local and reaches its slot only when the body
+        # reads it, when the loop is left and at jit back-edges
+        reads = node.reads_counter
+        jit = self.jit
+        for value in range(start, end + 1):
+            if reads:
+                slots[i] = value
+            signal = self.execute(node.instr)
+            if signal is not None and signal is not CONTINUE:
+                slots[i] = value
+                return None if signal is BREAK else signal
+            if jit is not None:
+                slots[i] = value + 1
+                if jit.back_edge(node, self.memory.stack, end):
+                    return None
+        slots[i] = max(start, end + 1)
+        return None
 
     @when(AST.Return)
     def visit(self, node: AST.Return):
-        raise ReturnValueException(node.expression.accept(self))
+        return ReturnValue(node.expression.accept(self))
 
     @when(AST.Break)
     def visit(self, node: AST.Break):
-        raise BreakException()
+        return BREAK
 
     @when(AST.Continue)
     def visit(self, node: AST.Continue):
-        raise ContinueException()
+        return CONTINUE
 
     @when(AST.Print)
     def visit(self, node: AST.Print):
-        to_print = [element.accept(self) for element in node.to_print]
+        to_print = [printable(element.accept(self)) for element in node.to_print.values]
         print(*to_print, sep=' ')
 
     @when(AST.Assignment)
     def visit(self, node: AST.Assignment):
-        if not isinstance(node.var, AST.Variable):
+        if isinstance(node.var, AST.Var):
             if node.operator == '=':
-                self.memory.set(node.var.id, node.expression.accept(self))
+                value = node.expression.accept(self)
+                self.store(node.var.binding, share(value) if node.shares else value)
+            elif node.inplace:
+                self.store(node.var.binding,
+                           augment(node.operator[0], self.load(node.var.binding), node.expression.accept(self)))
             else:
-                self.memory.set(node.var.id,
-                                operations[node.operator[0]](self.memory.get(node.var.id), node.expression.accept(self)))
+                self.store(node.var.binding,
+                           operations[node.operator[0]](self.load(node.var.binding), node.expression.accept(self)))
+            return
+        target = node.var.id.accept(self)
+        if isinstance(node.var, AST.VectorRef):
+            region = self.index(node.var.index)
         else:
-            matrix = self.memory.get(node.var.id.id)
-            if isinstance(node.var.index[0], tuple):
-                x = [i for i in range(node.var.index[0][0].accept(self), node.var.index[0][1].accept(self))]
-            else:
-                x = [node.var.index[0].accept(self)]
-            if isinstance(node.var.index[1], tuple):
-                y = [i for i in range(node.var.index[1][0].accept(self), node.var.index[1][1].accept(self))]
-            else:
-                y = [node.var.index[1].accept(self)]
-            if node.operator == '=':
-                for i in x:
-                    for j in y:
-                        matrix[j][i] = node.expression.accept(self)
-            else:
-                for i in x:
-                    for j in y:
-                        matrix[j][i] = operations[node.operator[0]](matrix[j][i], node.expression.accept(self))
-
-            self.memory.set(node.var.id.id, matrix)
+            region = (self.index(node.var.row_index), self.index(node.var.col_index))
+        operator = None if node.operator == '=' else node.operator[0]
+        matrix = assign(target, region, node.expression.accept(self), operator)
+        if matrix is not target:
+            self.store(node.var.id.binding, matrix)
+
+    def index(self, index):
+        if isinstance(index, AST.Range):
+            return slice(index.left.accept(self), index.right.accept(self))
+        return index.accept(self)
+
+    def index_range(self, index):
+        if isinstance(index, AST.Range):
+            return range(index.left.accept(self), index.right.accept(self))
+        return [index.accept(self)]
+
+    @when(AST.Matrix)
+    def visit(self, node: AST.Matrix):
+        return np.array([row.accept(self) for row in node.matrix])
 
     @when(AST.Vector)
     def visit(self, node: AST.Vector):
-        return [element.accept(self) for element in node.vector]
+        return np.array([element.accept(self) for element in node.vector])
+
+    @when(AST.VectorRef)
+    def visit(self, node: AST.VectorRef):
+        vector = node.id.accept(self)
+        if isinstance(node.index, AST.Range):
+            return vector[node.index.left.accept(self):node.index.right.accept(self)].copy()
+        return item(vector, node.index.accept(self))
 
     @when(AST.MatrixRef)
-    def visit(self, node: AST.Variable):
-        matrix = self.memory.get(node.id.id)
-        x = node.index[0].accept(self)
-        y = node.index[1].accept(self)
-        return matrix[x][y]
+    def visit(self, node: AST.MatrixRef):
+        matrix = node.id.accept(self)
+        x = self.index_range(node.row_index)
+        y = self.index_range(node.col_index)
+        if isinstance(node.row_index, AST.Range) or isinstance(node.col_index, AST.Range):
+            return submatrix(matrix, x, y)
+        return scalar(matrix[x[0], y[0]])
 
     @when(AST.MatrixFunction)
     def visit(self, node: AST.MatrixFunction):
         func = node.name
         args = [arg.accept(self) for arg in node.args]
+        return matrix_creators[func](args)
 
-        def create_matrix(rows, cols, fill_value):
-            return [[fill_value for _ in range(cols)] for _ in range(rows)]
-
-        def create_identity_matrix(size):
-            return [[1 if i == j else 0 for i in range(size)] for j in range(size)]
-
-        matrix_creators = {
-            'zeros': lambda args: create_matrix(args[0], args[1] if len(args) > 1 else args[0], 0),
-            'ones': lambda args: create_matrix(args[0], args[1] if len(args) > 1 else args[0], 1),
-            'eye': lambda args: create_identity_matrix(args[0])
-        }
-        return matrix_creators[func](args)
\ No newline at end of file
+    @when(AST.FunctionCall)
+    def visit(self, node: AST.FunctionCall):
+        args = [sequence(arg.left.accept(self), arg.right.accept(self)) if isinstance(arg, AST.Range)
+                else arg.accept(self) for arg in node.args]
+        return functions[node.name].function(args)
\ No newline at end of file
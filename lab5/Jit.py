@@ -0,0 +1,200 @@
+import AST
+from CodeGenerator import CodeGenerator, runtime
+from Resolver import walk
+
+numeric = (int, float)
+
+
+def arithmetic(operator, left, right):
+    # type of a native +, -, *, / on two numbers of the given types
+    if left in numeric and right in numeric:
+        return float if operator == '/' or float in (left, right) else int
+    return None
+
+
+# Compiles the rest of a running loop into a Python function. Symbols of the
+# scopes that are already active (the loop's own and the enclosing ones) are
+# read from the interpreter's frames when the function starts and written
+# back when it leaves, symbols of scopes inside the loop are plain locals as
+# in CodeGenerator. The code is specialized for the types the active symbols
+# had when the loop got hot and starts with guards on them; when a guard
+# fails the function returns False without running anything and the
+# interpreter carries on.
+class LoopCompiler(CodeGenerator):
+    def __init__(self, types, end_type=None):
+        super().__init__()
+        self.types = types
+        self.end_type = end_type
+        self.stable = {}
+        self.frame = 0
+
+    def generate(self, loop):
+        self.frame = loop.scope.frame
+        self.stable = self.stable_types(loop)
+        symbols = sorted(self.types, key=lambda symbol: symbol.index)
+        written = set(written_symbols(loop))
+
+        self.emit('def loop(frames, end):', loop.line)
+        self.level += 1
+        for frame in sorted({symbol.frame for symbol in symbols}):
+            self.emit(f'slots_{frame} = frames[{frame}].slots', loop.line)
+        for symbol in symbols:
+            self.emit(f'{self.name(symbol)} = slots_{symbol.frame}[{symbol.slot}]', loop.line)
+        guards = [f'{self.name(symbol)}.__class__ is not signature[{symbol.index}]'
+                  for symbol in symbols if self.stable[symbol] is not None]
+        if isinstance(loop, AST.For):
+            guards.append('end.__class__ is not end_type')
+        if guards:
+            self.emit(f'if {" or ".join(guards)}:', loop.line)
+            self.emit('    return False', loop.line)
+        self.emit('try:', loop.line)
+        self.level += 1
+        if isinstance(loop, AST.For):
+            self.resume(loop)
+        else:
+            loop.accept(self)
+        self.emit('pass', loop.line)
+        self.level -= 1
+        self.emit('finally:', loop.line)
+        for symbol in symbols:
+            if symbol in written:
+                self.emit(f'    slots_{symbol.frame}[{symbol.slot}] = {self.name(symbol)}', loop.line)
+        self.emit('    pass', loop.line)
+        self.emit('return True', loop.line)
+        return '\n'.join(text for text, line in self.lines) + '\n'
+
+    def enter(self, scope, line):
+        # the active scopes already have their frames
+        if scope.frame > self.frame:
+            super().enter(scope, line)
+
+    def resume(self, node):
+        # the interpreter has already advanced the counter, continue from
+        # the bound check with the end value it computed on entry
+        counter = self.read(node.binding)
+        self.loop_depth += 1
+        native = node.binding.static and self.stable[node.binding.symbols[0]] is int and self.end_type is int
+        if native and node.counted:
+            self.emit(f'for {counter} in range({counter}, end + 1):', node.line)
+            self.block(node.instr)
+            self.emit('else:', node.line)
+            self.emit(f'    {counter} = max({counter}, end + 1)', node.line)
+        else:
+            started = self.temp()
+            self.emit(f'{started} = False', node.line)
+            self.emit('while True:', node.line)
+            self.level += 1
+            self.emit(f'if {started}:', node.line)
+            self.level += 1
+            self.write(node.binding, f'{counter} + 1', node.line)
+            self.level -= 1
+            self.emit(f'{started} = True', node.line)
+            self.emit(f'if not {counter} <= end:', node.line)
+            self.emit('    break', node.line)
+            self.level -= 1
+            self.block(node.instr)
+        self.loop_depth -= 1
+
+    def stable_types(self, loop):
+        # a symbol keeps its entry type when every assignment in the loop
+        # provably produces that type again
+        stable = dict(self.types)
+        self.stable = stable
+        changed = True
+        while changed:
+            changed = False
+            for node in walk(loop):
+                if isinstance(node, AST.Assignment) and isinstance(node.var, AST.Var):
+                    bindings = [node.var.binding]
+                    produced = self.infer(node.expression)
+                    if node.operator != '=':
+                        produced = arithmetic(node.operator[0], self.infer(node.var), produced)
+                elif isinstance(node, AST.For) and node is not loop:
+                    bindings = [node.var.binding, node.binding]
+                    produced = self.infer(node.range.left) if self.infer(node.range.right) in numeric else None
+                else:
+                    continue
+                for binding in bindings:
+                    for symbol in binding.symbols:
+                        kind = produced if len(binding.symbols) == 1 else None
+                        if stable.get(symbol) is not None and stable[symbol] is not kind:
+                            stable[symbol] = None
+                            changed = True
+        return stable
+
+    def infer(self, node):
+        if isinstance(node, AST.Number):
+            return type(node.constant)
+        if isinstance(node, AST.Var):
+            symbols = node.binding.symbols
+            return self.stable.get(symbols[0]) if len(symbols) == 1 else None
+        if isinstance(node, AST.Uminus):
+            operand = self.infer(node.right)
+            return operand if operand in numeric else None
+        if isinstance(node, AST.BinaryExpression):
+            return arithmetic(node.operator, self.infer(node.left), self.infer(node.right))
+        return None
+
+    def negation(self, node, operand):
+        if self.infer(node.right) in numeric:
+            return f'(-{operand})'
+        return super().negation(node, operand)
+
+    def never_matrix(self, node):
+        return self.infer(node) in numeric or super().never_matrix(node)
+
+
+# Counts loop back-edges for the interpreter. Once a loop has gone around
+# threshold times, the rest of it runs as a LoopCompiler function; a loop
+# keeps up to max_versions of them, one per set of entry types.
+class Jit(object):
+    def __init__(self, threshold=50, max_versions=4):
+        self.threshold = threshold
+        self.max_versions = max_versions
+        self.counts = {}
+        self.versions = {}
+        self.compiled_loops = 0
+        self.guard_failures = 0
+
+    def back_edge(self, loop, frames, end=None):
+        # returns True when compiled code has finished the loop
+        count = self.counts.get(loop, 0) + 1
+        self.counts[loop] = count
+        if count < self.threshold:
+            return False
+        versions = self.versions.setdefault(loop, [])
+        for function in versions:
+            if function(frames, end):
+                return True
+            self.guard_failures += 1
+        if len(versions) < self.max_versions:
+            versions.append(self.compile(loop, frames, end))
+            self.compiled_loops += 1
+            return versions[-1](frames, end)
+        self.counts[loop] = 0
+        return False
+
+    @staticmethod
+    def compile(loop, frames, end):
+        types = {}
+        for node in walk(loop):
+            if isinstance(node, AST.Var):
+                for symbol in node.binding.symbols:
+                    if symbol.frame <= loop.scope.frame:
+                        types[symbol] = frames[symbol.frame].slots[symbol.slot].__class__
+        signature = {symbol.index: symbol_type for symbol, symbol_type in types.items()}
+        namespace = dict(runtime, signature=signature, end_type=end.__class__)
+        exec(LoopCompiler(types, end.__class__).compile(loop, '<jit>'), namespace)
+        return namespace['loop']
+
+
+def written_symbols(loop):
+    for node in walk(loop):
+        if isinstance(node, AST.Assignment) and isinstance(node.var, AST.Var):
+            yield from node.var.binding.symbols
+        elif isinstance(node, AST.Assignment):
+            # a matrix that had to be widened or copied is rebound
+            yield from node.var.id.binding.symbols
+        elif isinstance(node, AST.For):
+            yield from node.var.binding.symbols
+            yield from node.binding.symbols
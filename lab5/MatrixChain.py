@@ -0,0 +1,80 @@
+import AST
+from Resolver import walk
+
+
+def chain_order(dims):
+    # classic dynamic programming over the factors' dimensions: factor k is
+    # dims[k] x dims[k + 1], split[i][j] is where the cheapest product of
+    # factors i..j divides into two
+    n = len(dims) - 1
+    cost = [[0] * n for _ in range(n)]
+    split = [[0] * n for _ in range(n)]
+    for length in range(2, n + 1):
+        for i in range(n - length + 1):
+            j = i + length - 1
+            cost[i][j] = None
+            for k in range(i, j):
+                candidate = cost[i][k] + cost[k + 1][j] + dims[i] * dims[k + 1] * dims[j + 1]
+                if cost[i][j] is None or candidate < cost[i][j]:
+                    cost[i][j], split[i][j] = candidate, k
+    return cost[0][n - 1], split
+
+
+def factors(node):
+    if is_product(node):
+        return factors(node.left) + factors(node.right)
+    return [node]
+
+
+def current_cost(node):
+    # multiplications the chain takes in its written order, and its size
+    if not is_product(node):
+        return 0, node.size
+    left_cost, (rows, inner) = current_cost(node.left)
+    right_cost, (_, cols) = current_cost(node.right)
+    return left_cost + right_cost + rows * inner * cols, (rows, cols)
+
+
+def is_product(node):
+    # a matrix product, not a matrix scaled by a number
+    return (isinstance(node, AST.BinaryExpression) and node.operator == '*' and
+            all(getattr(operand, 'type', None) in ('matrix', 'vector') for operand in (node.left, node.right)))
+
+
+# Rewrites chains of matrix products, which the grammar associates to the
+# left, into the cheapest order for the shapes TypeChecker inferred. A chain
+# is left alone unless the shape of every factor is known.
+class MatrixChainOptimizer(object):
+    def __init__(self):
+        self.rewritten = 0
+
+    def optimize(self, program):
+        done = set()
+        for node in walk(program):
+            if is_product(node) and node not in done:
+                self.rewrite(node)
+                done.update(product for product in walk(node) if is_product(product))
+        return self.rewritten
+
+    def rewrite(self, root):
+        chain = factors(root)
+        sizes = [getattr(factor, 'size', None) for factor in chain]
+        if len(chain) < 3 or None in sizes or any(factor.type not in ('matrix', 'vector') for factor in chain):
+            return
+        dims = [size[0] for size in sizes] + [sizes[-1][1]]
+        if any(sizes[k][1] != dims[k + 1] for k in range(len(chain))):
+            return
+        cost, split = chain_order(dims)
+
+        def build(i, j):
+            if i == j:
+                return chain[i]
+            node = AST.BinaryExpression('*', build(i, split[i][j]), build(split[i][j] + 1, j), line=root.line)
+            node.type = chain[i].type
+            node.size = (dims[i], dims[j + 1])
+            return node
+
+        if cost < current_cost(root)[0]:
+            best = build(0, len(chain) - 1)
+            root.left, root.right = best.left, best.right
+            self.rewritten += 1
@@ -1,3 +1,7 @@
+# marks a slot whose scope does not hold the variable (see Resolver)
+UNSET = object()
+
+
 class Memory:
     def __init__(self, name):  # memory name
         self.scope_name = name
@@ -41,3 +45,27 @@ class MemoryStack:
                     self.stack[i].put(key, self.stack[-1].get(key))
                     break
         self.stack.pop()
+
+
+class Frame:
+    def __init__(self, scope):  # slots of the variables the Resolver found in <scope>, in symbol.slot order
+        self.scope = scope
+        self.slots = [UNSET if symbol.guarded else None for symbol in scope.variables]
+
+
+class FrameStack:
+    def __init__(self):  # one frame per active scope, frame i holds the symbols with symbol.frame == i
+        self.stack = []
+
+    def get(self, name):  # gets from frame stack current value of variable <name>
+        for frame in reversed(self.stack):
+            symbol = frame.scope.symbols.get(name)
+            if symbol is not None and symbol.used and frame.slots[symbol.slot] is not UNSET:
+                return frame.slots[symbol.slot]
+        return None
+
+    def push(self, scope):  # pushes a frame for scope <scope> onto the stack
+        self.stack.append(Frame(scope))
+
+    def pop(self):  # pops the top frame, its variables die with it
+        self.stack.pop()
@@ -0,0 +1,697 @@
+import copy
+import math
+
+import AST
+from Builtins import functions
+from Interpreter import operations, negate
+from Memory import UNSET
+from Resolver import fields, walk, scalar_operators
+
+# lattice values of sparse conditional constant propagation besides the
+# constants themselves: nothing known yet, and more than one value. A
+# variable no assignment has set holds the constant UNSET, reading it is
+# not something to fold away.
+UNKNOWN = object()
+VARYING = object()
+
+scalars = (int, float, bool, str)
+
+# instructions that never fail and change nothing but the value they define
+pure = {'const', 'undef', 'set', 'maybe', 'first', 'phi', 'range', 'transpose'}
+
+
+def proven(graph, kinds):
+    # the instructions whose value is a Python value of one of kinds on every
+    # path, whatever types TypeChecker gave the expressions: starting from
+    # all of them, those that may give anything else are dropped until none
+    # is, so a phi of a loop keeps its place only when every value reaching
+    # it does
+    values = set(graph.instructions())
+    changed = True
+    while changed:
+        changed = False
+        for instruction in list(values):
+            if not gives(instruction, values, kinds):
+                values.discard(instruction)
+                changed = True
+    return values
+
+
+def gives(instruction, values, kinds):
+    op, args = instruction.op, instruction.args
+    if op == 'const':
+        return instruction.value.__class__ in kinds
+    if op in ('set', 'maybe', 'first', 'phi', 'negate'):
+        # a name no scope holds is read through a first of no candidates
+        return bool(args) and all(arg in values for arg in args)
+    if op == 'binary':
+        # a quotient is a float even of two ints
+        if instruction.operator == '/' and float not in kinds:
+            return False
+        return instruction.operator in scalar_operators and all(arg in values for arg in args)
+    if op == 'compare':
+        return bool in kinds and all(arg in values for arg in args)
+    return False
+
+
+def numbers(graph):
+    return proven(graph, (int, float, bool))
+
+
+def safe(instruction, numbers):
+    # whether running the instruction can neither fail nor change anything;
+    # arithmetic and comparisons on operands that are numbers on every path
+    # can only fail by dividing by zero, on a matrix, a string or a variable
+    # never set they may fail in many ways
+    if instruction.op in pure:
+        return True
+    if instruction.op not in ('binary', 'compare', 'negate') or any(arg not in numbers for arg in instruction.args):
+        return False
+    if instruction.op == 'negate':
+        return True
+    if instruction.operator != '/':
+        return instruction.operator in scalar_operators
+    divisor = instruction.args[1]
+    return divisor.op == 'const' and divisor.value.__class__ in (int, float) and divisor.value != 0
+
+
+def meet(a, b):
+    if a is UNKNOWN:
+        return b
+    if b is UNKNOWN or a is b:
+        return a
+    if a is VARYING or b is VARYING or a.__class__ is not b.__class__ or a != b:
+        return VARYING
+    return a
+
+
+def apply(function, values):
+    # a constant when every operand is one, the operation is done on them
+    # as the engines would do it at run time
+    if any(value is VARYING for value in values):
+        return VARYING
+    if any(value is UNKNOWN for value in values):
+        return UNKNOWN
+    if any(value.__class__ not in scalars for value in values):
+        return VARYING
+    try:
+        result = function(*values)
+    except Exception:
+        return VARYING
+    return result if result.__class__ in scalars else VARYING
+
+
+def literal(value, line):
+    # the tree of a folded number, a negative one under a unary minus since
+    # a Number's text is an int when it has digits only
+    number = AST.Number(repr(abs(value)) if value.__class__ is float else str(abs(value)), line=line)
+    number.type = 'int' if value.__class__ is int else 'float'
+    if math.copysign(1, value) > 0:
+        return number
+    node = AST.Uminus(number, line=line)
+    node.type = number.type
+    return node
+
+
+def is_literal(node):
+    return isinstance(node, AST.Number) or isinstance(node, AST.Uminus) and isinstance(node.right, AST.Number)
+
+
+def statements(instructions):
+    if isinstance(instructions, AST.Instructions):
+        return list(instructions.instructions)
+    return list(instructions) if isinstance(instructions, list) else [instructions]
+
+
+def substitute(node, replacements):
+    # puts replacements[child] in the place of every child of the tree that
+    # has one; a list replaces a statement with statements, spliced into the
+    # list holding it or made a block where a single statement stands
+    for name in fields(node):
+        value = getattr(node, name)
+        if isinstance(value, list):
+            children = []
+            for child in value:
+                child = replacements.get(child, child) if isinstance(child, AST.Node) else child
+                children.extend(child if isinstance(child, list) else [child])
+            setattr(node, name, children)
+            for child in children:
+                if isinstance(child, AST.Node):
+                    substitute(child, replacements)
+        elif isinstance(value, AST.Node):
+            child = replacements.get(value, value)
+            if isinstance(child, list):
+                child = AST.Instructions(child, line=value.line)
+            setattr(node, name, child)
+            substitute(child, replacements)
+
+
+def local(instructions, scope):
+    # whether the block has variables of its own, which would move to the
+    # enclosing scope if its statements were spliced into it
+    owned = set(scope.symbols.values())
+    for node in walk(instructions):
+        binding = getattr(node, 'binding', None)
+        if binding is not None and owned.intersection(binding.symbols):
+            return True
+    return False
+
+
+# Sparse conditional constant propagation (Wegman and Zadeck) over the SSA
+# graph: values are propagated only along edges that can run, so a variable
+# assigned on a branch a constant condition never takes stays a constant.
+# Expressions found constant are replaced by their value, and conditionals
+# on a constant by the branch that runs.
+class ConstantPropagation(object):
+    name = 'constants'
+
+    def run(self, graph):
+        self.propagate(graph)
+        self.changes = []
+        replacements = {}
+        self.branches(graph, replacements)
+        self.fold(graph, graph.program, replacements)
+        substitute(graph.program, replacements)
+        # sizes TypeChecker could not know until the arguments folded, an
+        # operand before the transposition of it
+        for node in reversed(list(walk(graph.program))):
+            if isinstance(node, AST.MatrixFunction) and all(isinstance(arg, AST.Number) for arg in node.args):
+                sizes = [arg.constant for arg in node.args]
+                node.size = (sizes[0], sizes[-1])
+            elif isinstance(node, AST.Transposition) and node.size is None and node.matrix.size is not None:
+                node.size = (node.matrix.size[1], node.matrix.size[0])
+        return sorted(self.changes, key=lambda change: change[0])
+
+    def propagate(self, graph):
+        self.values = {}
+        self.edges = set()
+        self.reached = set()
+        self.flow = [(None, graph.entry)]
+        self.work = []
+        while self.flow or self.work:
+            if self.flow:
+                edge = self.flow.pop()
+                if edge in self.edges:
+                    continue
+                self.edges.add(edge)
+                block = edge[1]
+                for phi in block.phis:
+                    self.update(phi)
+                if block not in self.reached:
+                    self.reached.add(block)
+                    for instruction in block.instructions:
+                        self.update(instruction)
+            else:
+                instruction = self.work.pop()
+                if instruction.block in self.reached:
+                    self.update(instruction)
+
+    def value(self, instruction):
+        return self.values.get(instruction, UNKNOWN)
+
+    def update(self, instruction):
+        if instruction.op in ('jump', 'return'):
+            self.flow.extend((instruction.block, target) for target in instruction.targets)
+            return
+        if instruction.op == 'branch':
+            condition = self.value(instruction.args[0])
+            if condition is VARYING or condition is UNSET:
+                targets = instruction.targets
+            elif condition is UNKNOWN:
+                targets = []
+            else:
+                targets = [instruction.targets[0 if condition else 1]]
+            self.flow.extend((instruction.block, target) for target in targets)
+            return
+        value = self.evaluate(instruction)
+        old = self.value(instruction)
+        if value is not old and (value is VARYING or old is UNKNOWN):
+            self.values[instruction] = value
+            self.work.extend(instruction.users)
+
+    def evaluate(self, instruction):
+        op, args = instruction.op, instruction.args
+        if op == 'const':
+            return instruction.value
+        if op == 'undef':
+            return UNSET
+        if op == 'set':
+            return self.value(args[0])
+        if op == 'maybe':
+            # the value written or, if it went to another scope, the old one
+            return meet(self.value(args[0]), self.value(args[1]))
+        if op == 'first':
+            for arg in args:
+                value = self.value(arg)
+                if value is not UNSET:
+                    return value
+            return UNSET
+        if op == 'phi':
+            value = UNKNOWN
+            block = instruction.block
+            for predecessor, arg in zip(block.predecessors, args):
+                if (predecessor, block) in self.edges:
+                    value = meet(value, self.value(arg))
+            return value
+        if op in ('binary', 'compare'):
+            return apply(operations[instruction.operator], [self.value(arg) for arg in args])
+        if op == 'negate':
+            return apply(negate, [self.value(args[0])])
+        if op == 'call':
+            function = functions[instruction.function].function
+            return apply(lambda *values: function(list(values)), [self.value(arg) for arg in args])
+        return VARYING
+
+    def constant(self, graph, node):
+        # the value of an expression the analysis found constant, or None
+        instruction = graph.values.get(node)
+        if instruction is None or instruction.block not in self.reached:
+            return None
+        value = self.value(instruction)
+        return None if value is UNKNOWN or value is VARYING else value
+
+    def branches(self, graph, replacements):
+        for node in walk(graph.program):
+            if not isinstance(node, (AST.If, AST.Ifelse, AST.While)):
+                continue
+            condition = self.constant(graph, node.cond)
+            if condition is None:
+                continue
+            if isinstance(node, AST.While):
+                if not condition:
+                    replacements[node] = []
+                    self.changes.append((node.line, 'removed a while loop whose condition is never true'))
+                continue
+            if isinstance(node, AST.If):
+                if not condition:
+                    replacements[node] = []
+                    self.changes.append((node.line, 'removed an if whose condition is never true'))
+                elif not local(node.instr, node.scope):
+                    replacements[node] = statements(node.instr)
+                    self.changes.append((node.line, 'replaced an if whose condition is always true by its body'))
+                continue
+            taken, scope = (node.instr, node.scope) if condition else (node.instr_else, node.else_scope)
+            dropped = 'else' if condition else 'then'
+            if local(taken, scope):
+                # the branch keeps a block of its own for its variables
+                always = AST.Number('1', line=node.line)
+                always.type = 'int'
+                replacements[node] = AST.If(always, taken, line=node.line)
+            else:
+                replacements[node] = statements(taken)
+            self.changes.append((node.line, f'removed the {dropped} branch, the condition is always {bool(condition)}'))
+
+    def fold(self, graph, node, replacements):
+        # replaces the largest constant expressions, not the name of an
+        # indexed variable nor what an assignment writes to
+        for name in fields(node):
+            if name == 'id' or isinstance(node, (AST.Assignment, AST.For)) and name == 'var':
+                continue
+            value = getattr(node, name)
+            for child in value if isinstance(value, list) else [value]:
+                if not isinstance(child, AST.Node):
+                    continue
+                constant = None if is_literal(child) or child in replacements else self.constant(graph, child)
+                if constant.__class__ in (int, float) and math.isfinite(constant):
+                    replacements[child] = literal(constant, child.line)
+                    if isinstance(child, AST.Var):
+                        self.changes.append((child.line, f'{child.name} is always {constant}'))
+                    else:
+                        self.changes.append((child.line, f'folded an expression to {constant}'))
+                else:
+                    self.fold(graph, child, replacements)
+
+
+# Removes assignments to variables whose value is never read: instructions
+# that print, branch, write into a matrix or may fail are live, and so is
+# every instruction whose value a live one uses, the rest are dead. An
+# assignment is removed when none of its instructions is live, and either
+# the name is already set where it writes, so that removing it does not
+# move later writes to another scope, or the name is never read at all.
+class DeadCodeElimination(object):
+    name = 'dead code'
+
+    def run(self, graph):
+        live = self.mark(graph)
+        lowered = {}
+        for instruction in graph.instructions():
+            lowered.setdefault(instruction.statement, []).append(instruction)
+        read = {node.name for node in graph.values if isinstance(node, AST.Var)}
+        for node in walk(graph.program):
+            # op= and writes into a matrix read the variable as well
+            if isinstance(node, AST.Assignment) and not isinstance(node.var, AST.Var):
+                read.add(node.var.id.name)
+            elif isinstance(node, AST.Assignment) and node.operator != '=':
+                read.add(node.var.name)
+        changes = []
+        replacements = {}
+        for node, instructions in lowered.items():
+            if not isinstance(node, AST.Assignment) or not isinstance(node.var, AST.Var):
+                continue
+            binding = node.var.binding
+            if node.operator != '=' or any(instruction in live for instruction in instructions):
+                continue
+            if binding.static or node.var.name not in read:
+                replacements[node] = []
+                changes.append((node.line, f'removed an assignment to {node.var.name}, which is never read'))
+        substitute(graph.program, replacements)
+        return sorted(changes, key=lambda change: change[0])
+
+    def mark(self, graph):
+        live = set()
+        known = numbers(graph)
+        work = [instruction for instruction in graph.instructions() if not safe(instruction, known)]
+        live.update(work)
+        while work:
+            for arg in work.pop().args:
+                if arg not in live:
+                    live.add(arg)
+                    work.append(arg)
+        return live
+
+
+def defined(instruction, seen=None):
+    # whether the variable version is set on every path, it is not when an
+    # undef reaches it; a cycle of phis is set if its way in is
+    seen = set() if seen is None else seen
+    if instruction in seen:
+        return True
+    seen.add(instruction)
+    if instruction.op == 'undef':
+        return False
+    if instruction.op in ('phi', 'maybe'):
+        return all(defined(arg, seen) for arg in instruction.args)
+    return True
+
+
+def owned_symbols(node):
+    # the symbols of the scopes of the loop and of every block inside it
+    symbols = set()
+    for inner in walk(node):
+        for name in ('scope', 'else_scope'):
+            scope = getattr(inner, name, None)
+            if scope is not None:
+                symbols.update(scope.symbols.values())
+    return symbols
+
+
+def invariant(graph, loop, node, numbers):
+    # whether no iteration of the loop changes the expression's value and
+    # evaluating it can neither fail nor change anything
+    instruction = graph.values.get(node)
+    if instruction is None:
+        return False
+    if isinstance(node, AST.Var):
+        if loop.owned.intersection(node.binding.symbols):
+            return False
+        versions = instruction.args if instruction.op == 'first' else [instruction]
+        return all(version.block not in loop.blocks and defined(version) for version in versions)
+    if isinstance(node, (AST.Number, AST.String)):
+        return True
+    children = operands(node)
+    return (children is not None and safe(instruction, numbers) and
+            all(invariant(graph, loop, child, numbers) for child in children))
+
+
+def temporaries(program, prefix):
+    # names of new variables, none of them used in the program
+    names = {node.name for node in walk(program) if isinstance(node, AST.Var)}
+    return (name for name in (f'{prefix}{k}' for k in range(len(names) + 1 << 20)) if name not in names)
+
+
+def operands(node):
+    if isinstance(node, (AST.BinaryExpression, AST.Condition)):
+        return [node.left, node.right]
+    if isinstance(node, AST.Uminus):
+        return [node.right]
+    if isinstance(node, AST.Transposition):
+        return [node.matrix]
+    return None
+
+
+# Moves expressions whose operands no iteration changes out of While and For
+# loops: each is computed once into a new variable assigned right before
+# the loop, in the scope holding the loop, and read from it inside. Only
+# expressions that can neither fail nor change anything are moved, since
+# a break may leave the loop before reaching them. Unless the loop is known
+# to run, the assignments are also guarded by its entry test, the variables
+# being set to 0 before it so that they live outside the guard. Their
+# operands must be set before the loop, in a scope outside it, so they mean
+# the same there. An expression is taken out of the outermost loop it does
+# not vary in.
+class LoopInvariantCodeMotion(object):
+    name = 'loop invariants'
+
+    def run(self, graph):
+        self.graph = graph
+        loops = {loop.node: loop for loop in graph.loops()}
+        self.temporaries = temporaries(graph.program, 'invariant')
+        self.numbers = numbers(graph)
+        self.changes = []
+        replacements = {}
+        hoisted = {}
+        for node in walk(graph.program):
+            loop = loops.get(node)
+            if loop is not None:
+                loop.owned = owned_symbols(node)
+                body = [node.cond, node.instr] if isinstance(node, AST.While) else [node.instr]
+                for part in body:
+                    self.hoist(loop, part, replacements, hoisted.setdefault(node, []))
+        # the entry tests are copied before the expressions in them are replaced
+        preheaders = {node: self.preheader(loops[node], assignments) for node, assignments in hoisted.items()
+                      if assignments}
+        substitute(graph.program, replacements)
+        substitute(graph.program, {node: statements + [node] for node, statements in preheaders.items()})
+        return sorted(self.changes, key=lambda change: change[0])
+
+    def preheader(self, loop, assignments):
+        node = loop.node
+        if loop.trips is not None and loop.trips > 0:
+            return assignments
+        if isinstance(node, AST.While):
+            test = clone(node.cond, {})
+        else:
+            test = AST.Condition('<=', clone(node.range.left, {}), clone(node.range.right, {}), line=node.line)
+            test.type = 'bool'
+        declarations = []
+        for assignment in assignments:
+            zero = AST.Number('0', line=node.line)
+            zero.type = 'int'
+            declarations.append(AST.Assignment('=', AST.Var(assignment.var.name, line=node.line), zero, line=node.line))
+        return declarations + [AST.If(test, AST.Instructions(assignments, line=node.line), line=node.line)]
+
+    def hoist(self, loop, node, replacements, assignments):
+        children = [node] if not isinstance(node, list) else node
+        for child in children:
+            if not isinstance(child, AST.Node) or child in replacements:
+                continue
+            if self.movable(child) and invariant(self.graph, loop, child, self.numbers):
+                name = next(self.temporaries)
+                var = AST.Var(name, line=child.line)
+                var.type, var.size = child.type, child.size
+                replacements[child] = var
+                target = AST.Var(name, line=loop.node.line)
+                assignments.append(AST.Assignment('=', target, child, line=loop.node.line))
+                self.changes.append((child.line, f'computed an expression once before the loop on line {loop.node.line}'))
+                continue
+            for name in fields(child):
+                if name == 'id' or isinstance(child, (AST.Assignment, AST.For)) and name == 'var':
+                    continue
+                self.hoist(loop, getattr(child, name), replacements, assignments)
+
+    def movable(self, node):
+        # an operation worth a variable of its own; a transposition alone is
+        # a view, as cheap to make as to read
+        if isinstance(node, AST.Transposition):
+            return operands(node.matrix) is not None
+        if isinstance(node, AST.Uminus):
+            return not isinstance(node.right, AST.Number)
+        return isinstance(node, (AST.BinaryExpression, AST.Condition))
+
+
+
+def clone(node, replacements):
+    # a copy of an expression, to be lowered anew, with a copy of
+    # replacements[child] in the place of a child that has one
+    node = replacements.get(node, node)
+    duplicate = copy.copy(node)
+    for name in fields(node):
+        value = getattr(node, name)
+        if isinstance(value, AST.Node):
+            setattr(duplicate, name, clone(value, replacements))
+        elif isinstance(value, list):
+            setattr(duplicate, name, [clone(item, replacements) if isinstance(item, AST.Node) else item
+                                      for item in value])
+    return duplicate
+
+
+# Strength reduction of the For loops whose counter the body never assigns,
+# and of the loops' other basic induction variables (see NaturalLoop). An
+# expression of +, - and * that is linear in one of them, a * n + b with a
+# and b the same on every iteration, is read from a new variable instead,
+# set to its value for the initial n less a * step right before the loop and
+# increased by a * step at the start of every iteration, where a continue
+# cannot skip it. Every value in it must be proven an int on every path, as
+# adding floats rounds differently from multiplying them. Only expressions
+# that multiply n are replaced, and not in loops known to run less than
+# twice.
+class StrengthReduction(object):
+    name = 'strength reduction'
+
+    def run(self, graph):
+        self.graph = graph
+        loops = {loop.node: loop for loop in graph.loops()}
+        self.temporaries = temporaries(graph.program, 'induction')
+        self.numbers = numbers(graph)
+        self.integers = proven(graph, (int,))
+        self.changes = []
+        replacements = {}
+        for node in walk(graph.program):
+            loop = loops.get(node)
+            if isinstance(node, AST.For) and loop is not None and (loop.trips is None or loop.trips > 1):
+                loop.owned = owned_symbols(node)
+                prologue, updates = [], []
+                self.reduce(loop, node.instr, replacements, prologue, updates)
+                if not updates:
+                    continue
+                if isinstance(node.instr, AST.Instructions):
+                    node.instr.instructions[:0] = updates
+                else:
+                    node.instr = AST.Instructions(updates + [node.instr], line=node.line)
+                replacements[node] = prologue + [node]
+        substitute(graph.program, replacements)
+        return sorted(self.changes, key=lambda change: change[0])
+
+    def reduce(self, loop, node, replacements, prologue, updates):
+        children = [node] if not isinstance(node, list) else node
+        for child in children:
+            if not isinstance(child, AST.Node) or child in replacements:
+                continue
+            form = self.linear(loop, child) if isinstance(child, AST.BinaryExpression) else None
+            if form is not None and form[0] is not None and form[2] and form[1] != 0:
+                self.replace(loop, child, form, replacements, prologue, updates)
+                continue
+            for name in fields(child):
+                if name == 'id' or isinstance(child, (AST.Assignment, AST.For)) and name == 'var':
+                    continue
+                self.reduce(loop, getattr(child, name), replacements, prologue, updates)
+
+    def linear(self, loop, node):
+        # (induction variable, a, whether it is multiplied) for an int
+        # expression a * n + b, with a an int or a tree; (None, 0, False) for
+        # one the loop does not change, None for any other
+        instruction = self.graph.values.get(node)
+        if instruction not in self.integers:
+            return None
+        if isinstance(node, AST.Var) and instruction in loop.inductions:
+            return instruction, 1, False
+        if invariant(self.graph, loop, node, self.numbers):
+            return None, 0, False
+        if isinstance(node, AST.Uminus):
+            right = self.linear(loop, node.right)
+            return None if right is None else (right[0], negative(right[1], node.line), right[2])
+        if not isinstance(node, AST.BinaryExpression) or node.operator not in ('+', '-', '*'):
+            return None
+        left, right = self.linear(loop, node.left), self.linear(loop, node.right)
+        if left is None or right is None or None not in (left[0], right[0]) and left[0] is not right[0]:
+            return None
+        induction = left[0] or right[0]
+        if node.operator == '+':
+            return induction, plus(left[1], right[1], node.line), left[2] or right[2]
+        if node.operator == '-':
+            return induction, plus(left[1], negative(right[1], node.line), node.line), left[2] or right[2]
+        if left[0] is not None and right[0] is not None:
+            return None
+        if left[0] is None:
+            return induction, times(term(node.left), right[1], node.line), right[0] is not None
+        return induction, times(left[1], term(node.right), node.line), left[0] is not None
+
+    def replace(self, loop, node, form, replacements, prologue, updates):
+        induction, factor, _ = form
+        initial = self.initial(loop, induction, prologue)
+        if initial is None:
+            return
+        line = loop.node.line
+        step = times(factor, loop.inductions[induction][1], line)
+        if step.__class__ is not int and not isinstance(step, (AST.Var, AST.Number)):
+            # a step that is an expression is computed once
+            name = next(self.temporaries)
+            prologue.append(AST.Assignment('=', AST.Var(name, line=line), clone(step, {}), line=line))
+            step = AST.Var(name, line=line)
+            step.type = 'int'
+        reads = {var: initial for var in walk(node) if isinstance(var, AST.Var)
+                 and self.graph.values.get(var) is induction}
+        name = next(self.temporaries)
+        start = AST.BinaryExpression('-', clone(node, reads), value(step, line), line=line)
+        start.type = 'int'
+        prologue.append(AST.Assignment('=', AST.Var(name, line=line), start, line=line))
+        updates.append(AST.Assignment('+=', AST.Var(name, line=line), value(step, line), line=line))
+        var = AST.Var(name, line=node.line)
+        var.type = 'int'
+        replacements[node] = var
+        counter = induction.symbol.name
+        self.changes.append((node.line, f'replaced a product of {counter} by a variable increased on every '
+                                        f'iteration of the loop on line {line}'))
+
+    def initial(self, loop, induction, prologue):
+        # an expression for the value the induction variable enters the loop
+        # with, that can be evaluated right before the loop
+        node = loop.node
+        if induction.symbol in node.binding.symbols:
+            start = node.range.left
+            if not isinstance(start, (AST.Var, AST.Number)):
+                name = next(self.temporaries)
+                prologue.append(AST.Assignment('=', AST.Var(name, line=node.line), start, line=node.line))
+                start = AST.Var(name, line=node.line)
+                start.type = 'int'
+                node.range.left = start
+            return start
+        entry = loop.inductions[induction][0]
+        if induction.symbol in loop.owned or not defined(entry):
+            return None
+        var = AST.Var(induction.symbol.name, line=node.line)
+        var.type = 'int'
+        return var
+
+
+def term(node):
+    # the value of an int literal, the tree of any other expression
+    if isinstance(node, AST.Number):
+        return node.constant
+    if isinstance(node, AST.Uminus) and isinstance(node.right, AST.Number):
+        return -node.right.constant
+    return node
+
+
+def value(a, line):
+    return literal(a, line) if a.__class__ is int else clone(a, {})
+
+
+def plus(a, b, line):
+    if a.__class__ is int and b.__class__ is int:
+        return a + b
+    if a == 0 or b == 0:
+        return b if a == 0 else a
+    node = AST.BinaryExpression('+', value(a, line), value(b, line), line=line)
+    node.type = 'int'
+    return node
+
+
+def negative(a, line):
+    if a.__class__ is int:
+        return -a
+    node = AST.Uminus(value(a, line), line=line)
+    node.type = 'int'
+    return node
+
+
+def times(a, b, line):
+    if a.__class__ is int and b.__class__ is int:
+        return a * b
+    if a == 0 or b == 0:
+        return 0
+    if a == 1 or b == 1:
+        return b if a == 1 else a
+    node = AST.BinaryExpression('*', value(a, line), value(b, line), line=line)
+    node.type = 'int'
+    return node
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Matrices nothing refers to any more, kept by shape and type so that the
+# next result of the same size is written into one of them instead of a new
+# allocation. Once they take more than capacity bytes, buffers of the least
+# recently used sizes are dropped first.
+class BufferPool(object):
+    def __init__(self, capacity=64 * 2 ** 20):
+        self.capacity = capacity
+        self.buffers = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, shape, dtype):
+        key = (shape, np.dtype(dtype))
+        free = self.buffers.get(key)
+        if not free:
+            self.misses += 1
+            return np.empty(shape, dtype)
+        self.hits += 1
+        self.buffers.move_to_end(key)
+        buffer = free.pop()
+        if not free:
+            del self.buffers[key]
+        self.bytes -= buffer.nbytes
+        return buffer
+
+    def give(self, buffer):
+        if buffer.base is not None or not buffer.flags.writeable or buffer.nbytes > self.capacity:
+            return
+        key = (buffer.shape, buffer.dtype)
+        self.buffers.setdefault(key, []).append(buffer)
+        self.buffers.move_to_end(key)
+        self.bytes += buffer.nbytes
+        while self.bytes > self.capacity:
+            key, free = next(iter(self.buffers.items()))
+            self.bytes -= free.pop(0).nbytes
+            if not free:
+                del self.buffers[key]
+
+    def result(self, dead, shape, dtype):
+        # where to write a result: dead is the old value of the assigned
+        # variable when nothing else can refer to it, reused if it fits
+        if dead.__class__ is np.ndarray and dead.shape == shape and dead.dtype == dtype and \
+                dead.base is None and dead.flags.writeable:
+            self.hits += 1
+            return dead
+        return self.take(shape, dtype)
+
+    def clear(self):
+        self.buffers.clear()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+pool = BufferPool()
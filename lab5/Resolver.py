@@ -0,0 +1,320 @@
+import AST
+from Builtins import functions
+from SymbolTable import VariableSymbol
+from TypeChecker import NodeVisitor
+
+
+def fields(node):
+    # children are found through the constructor's parameter names, reading
+    # vars(node) would make CPython build a __dict__ for every node and slow
+    # down attribute access of whatever runs over the tree afterwards
+    code = node.__class__.__init__.__code__
+    return [name for name in code.co_varnames[1:code.co_argcount] if hasattr(node, name)]
+
+
+def walk(node):
+    if isinstance(node, AST.Node):
+        yield node
+        for name in fields(node):
+            yield from walk(getattr(node, name))
+    elif isinstance(node, list):
+        for value in node:
+            yield from walk(value)
+
+
+# MemoryStack writes go to the top scope and are copied to the nearest outer
+# scope holding the same name on pop. That is the same as writing straight to
+# the one scope that holds the name, or creating it in the current scope if
+# none does, so at any time a name is bound in at most one scope.
+#
+# Resolver finds, for every variable access, the scopes that may hold the
+# name at that point (outermost first). Each scope's symbols are the names
+# assigned directly in it; a name is "bound" in a scope once an assignment
+# in that scope has run, which means it lives there or further out. When the
+# innermost candidate is bound, reads never fall through to undefined.
+def direct_writes(node):
+    if isinstance(node, AST.Instructions):
+        for instruction in node.instructions:
+            yield from direct_writes(instruction)
+    elif isinstance(node, AST.Assignment) and isinstance(node.var, AST.Var):
+        yield node.var.name
+
+
+def assigns(node, name):
+    if isinstance(node, AST.Instructions):
+        return any(assigns(instruction, name) for instruction in node.instructions)
+    if isinstance(node, AST.Assignment):
+        return isinstance(node.var, AST.Var) and node.var.name == name
+    if isinstance(node, AST.For):
+        return node.var.name == name or assigns(node.instr, name)
+    if isinstance(node, (AST.If, AST.While)):
+        return assigns(node.instr, name)
+    if isinstance(node, AST.Ifelse):
+        return assigns(node.instr, name) or assigns(node.instr_else, name)
+    return False
+
+
+scalar_operators = {'+', '-', '*', '/', '<', '>', '<=', '>=', '==', '!='}
+
+
+def fresh(node):
+    # an expression whose value is never an object a variable already holds
+    return not isinstance(node, (AST.Var, AST.Transposition, AST.MatrixFunction))
+
+
+def never_matrix(node, scalars):
+    if isinstance(node, (AST.Number, AST.String)):
+        return True
+    if isinstance(node, AST.Var):
+        return all(symbol in scalars for symbol in node.binding.symbols)
+    if isinstance(node, AST.Uminus):
+        return never_matrix(node.right, scalars)
+    if isinstance(node, (AST.BinaryExpression, AST.Condition)):
+        return (node.operator in scalar_operators and
+                never_matrix(node.left, scalars) and never_matrix(node.right, scalars))
+    if isinstance(node, AST.MatrixRef):
+        return not isinstance(node.row_index, AST.Range) and not isinstance(node.col_index, AST.Range)
+    if isinstance(node, AST.FunctionCall):
+        return (len(node.args) in functions[node.name].reduces or
+                all(never_matrix(arg, scalars) for arg in node.args))
+    return False
+
+
+def scalar_symbols(program):
+    # symbols that never hold a matrix: every write to them stores a
+    # scalar, provided the symbols it reads never hold one either
+    writes = []
+    for node in walk(program):
+        if isinstance(node, AST.Assignment) and isinstance(node.var, AST.Var):
+            values = [node.expression] if node.operator == '=' else [node.var, node.expression]
+            writes.append((node.var.binding.symbols, values))
+        elif isinstance(node, AST.For):
+            writes.append((node.var.binding.symbols + node.binding.symbols, [node.range.left]))
+    scalars = {symbol for symbols, values in writes for symbol in symbols}
+    changed = True
+    while changed:
+        changed = False
+        for symbols, values in writes:
+            if scalars.issuperset(symbols) and not all(never_matrix(value, scalars) for value in values):
+                scalars.difference_update(symbols)
+                changed = True
+    return scalars
+
+
+class Binding(object):
+    def __init__(self, symbols, bound):
+        self.symbols = symbols
+        self.bound = bound
+        # a single candidate that is bound: the name lives in exactly that slot
+        self.static = len(symbols) == 1 and bound
+
+
+class Resolver(NodeVisitor):
+    # whether blocks without variables of their own run in their parent's
+    # frame; benchmark.py turns it off to measure what eliding saves
+    elide = True
+
+    def __init__(self):
+        super().__init__()
+        self.scopes = [self.global_scope]
+        self.bound = {self.global_scope: set()}
+        self.symbol_count = 0
+        self.reads = set()
+
+    def resolve(self, program):
+        self.declare(self.global_scope, direct_writes(program))
+        program.scope = self.global_scope
+        self.visit(program)
+        self.allocate()
+        self.own(program)
+        return self.scopes
+
+    def allocate(self):
+        # a block gets a frame only when a variable lives in its scope,
+        # otherwise it is elided and runs in the frame of its parent
+        for scope in self.scopes:
+            scope.variables = [symbol for symbol in scope.symbols.values() if symbol.used]
+            parent = scope.parent_scope
+            scope.elided = self.elide and parent is not None and not scope.variables
+            scope.frame = 0 if parent is None else parent.frame + (not scope.elided)
+            for slot, symbol in enumerate(scope.variables):
+                symbol.frame = scope.frame
+                symbol.slot = slot
+
+    def own(self, program):
+        # assigning an object a variable already holds shares it, which the
+        # engines mark at run time so that writes copy it first; op= on a
+        # symbol that may hold a matrix updates it in place unless shared
+        scalars = scalar_symbols(program)
+        for node in walk(program):
+            if isinstance(node, AST.Assignment) and isinstance(node.var, AST.Var):
+                matrix = not scalars.issuperset(node.var.binding.symbols)
+                if node.operator == '=':
+                    node.shares = matrix and not fresh(node.expression)
+                else:
+                    node.inplace = matrix
+
+    def declare(self, scope, names):
+        for name in names:
+            if name not in scope.symbols:
+                symbol = VariableSymbol(name, None)
+                symbol.index = self.symbol_count
+                symbol.guarded = False
+                symbol.used = False
+                self.symbol_count += 1
+                scope.put(name, symbol)
+
+    def push(self, name, body, *names):
+        self.current_scope = self.current_scope.pushScope(name)
+        self.scopes.append(self.current_scope)
+        self.bound[self.current_scope] = set()
+        self.declare(self.current_scope, names)
+        self.declare(self.current_scope, direct_writes(body))
+        return self.current_scope
+
+    def pop(self):
+        self.current_scope = self.current_scope.popScope()
+
+    def lookup(self, name):
+        chain = []
+        scope = self.current_scope
+        while scope is not None:
+            if name in scope.symbols:
+                chain.append(scope)
+            scope = scope.parent_scope
+        chain.reverse()
+
+        bound = False
+        for i, scope in enumerate(chain):
+            if name in self.bound[scope]:
+                chain, bound = chain[:i + 1], True
+                break
+        symbols = tuple(scope.symbols[name] for scope in chain)
+        for symbol in symbols:
+            symbol.used = True
+            symbol.guarded = symbol.guarded or len(symbols) > 1
+        return Binding(symbols, bound)
+
+    def generic_visit(self, node):
+        pass
+
+    def visit_Instructions(self, node: AST.Instructions):
+        for instruction in node.instructions:
+            self.visit(instruction)
+
+    def visit_Assignment(self, node: AST.Assignment):
+        self.visit(node.expression)
+        if isinstance(node.var, AST.Var):
+            node.var.binding = self.lookup(node.var.name)
+            if isinstance(node.expression, AST.Elementwise) and node.operator == '=':
+                node.expression.dead = node.var.binding
+            self.bound[self.current_scope].add(node.var.name)
+        else:
+            self.visit(node.var)
+
+    def visit_Var(self, node: AST.Var):
+        node.binding = self.lookup(node.name)
+        self.reads.add(node.name)
+
+    def visit_BinaryExpression(self, node: AST.BinaryExpression):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Condition(self, node: AST.Condition):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Range(self, node: AST.Range):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Uminus(self, node: AST.Uminus):
+        self.visit(node.right)
+
+    def visit_Elementwise(self, node: AST.Elementwise):
+        node.dead = None
+        for leaf in node.leaves:
+            self.visit(leaf)
+
+    def visit_Transposition(self, node: AST.Transposition):
+        self.visit(node.matrix)
+
+    def visit_Number(self, node: AST.Number):
+        pass
+
+    def visit_String(self, node: AST.String):
+        pass
+
+    def visit_Matrix(self, node: AST.Matrix):
+        for row in node.matrix:
+            self.visit(row)
+
+    def visit_Vector(self, node: AST.Vector):
+        for element in node.vector:
+            self.visit(element)
+
+    def visit_VectorRef(self, node: AST.VectorRef):
+        self.visit(node.id)
+        self.visit(node.index)
+
+    def visit_MatrixRef(self, node: AST.MatrixRef):
+        self.visit(node.id)
+        self.visit(node.row_index)
+        self.visit(node.col_index)
+
+    def visit_MatrixFunction(self, node: AST.MatrixFunction):
+        for arg in node.args:
+            self.visit(arg)
+
+    def visit_FunctionCall(self, node: AST.FunctionCall):
+        for arg in node.args:
+            self.visit(arg)
+
+    def visit_Print(self, node: AST.Print):
+        for value in node.to_print.values:
+            self.visit(value)
+
+    def visit_Return(self, node: AST.Return):
+        self.visit(node.expression)
+
+    def visit_Break(self, node: AST.Break):
+        pass
+
+    def visit_Continue(self, node: AST.Continue):
+        pass
+
+    def visit_If(self, node: AST.If):
+        self.visit(node.cond)
+        node.scope = self.push('if', node.instr)
+        self.visit(node.instr)
+        self.pop()
+
+    def visit_Ifelse(self, node: AST.Ifelse):
+        self.visit(node.cond)
+        node.scope = self.push('if', node.instr)
+        self.visit(node.instr)
+        self.pop()
+        node.else_scope = self.push('else', node.instr_else)
+        self.visit(node.instr_else)
+        self.pop()
+
+    def visit_While(self, node: AST.While):
+        node.scope = self.push('while', node.instr)
+        self.visit(node.cond)
+        self.visit(node.instr)
+        self.pop()
+
+    def visit_For(self, node: AST.For):
+        self.visit(node.range)
+        node.scope = self.push('for', node.instr, node.var.name)
+        node.var.binding = self.lookup(node.var.name)
+        self.bound[node.scope].add(node.var.name)
+        node.binding = self.lookup(node.var.name)
+        outer_reads, self.reads = self.reads, set()
+        self.visit(node.instr)
+        self.pop()
+        # a counted loop only advances its counter itself, so it can run
+        # over a native range, storing the counter only if the body reads it
+        node.counted = not assigns(node.instr, node.var.name)
+        node.reads_counter = node.var.name in self.reads
+        self.reads |= outer_reads
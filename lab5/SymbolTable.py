@@ -3,10 +3,11 @@ class Symbol:
 
 
 class VariableSymbol:
-    def __init__(self, name, type, size=None):
+    def __init__(self, name, type, size=None, element=None):
         self.name = name
         self.type = type
         self.size = size
+        self.element = element
 
 
 
@@ -23,8 +24,9 @@ class SymbolTable(object):
     def get(self, name):
         if name in self.symbols:
             return self.symbols[name]
-        else:
+        elif self.parent_scope is not None:
             return self.parent_scope.get(name)
+        return None
 
     def pushScope(self, name):
         return SymbolTable(self, name)
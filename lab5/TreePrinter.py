@@ -139,7 +139,7 @@ class TreePrinter:
     def printTree(self, indent=0):
         print(f"{TreePrinter.indent(indent)}VECTOR INIT")
         self.id.printTree(indent + 1)
-        print(f"{TreePrinter.indent(indent + 1)}{self.index}")
+        self.index.printTree(indent + 1)
 
     @addToClass(AST.MatrixFunction)
     def printTree(self, indent=0):
@@ -147,6 +147,12 @@ class TreePrinter:
         for arg in self.args:
             print(f"{TreePrinter.indent(indent + 1)}{arg}")
 
+    @addToClass(AST.FunctionCall)
+    def printTree(self, indent=0):
+        print(f"{TreePrinter.indent(indent)}{self.name}")
+        for arg in self.args:
+            arg.printTree(indent + 1)
+
     @addToClass(AST.ToPrint)
     def printTree(self, indent=0):
         for val in self.values:
@@ -1,5 +1,6 @@
 
 import AST
+from Builtins import functions
 from SymbolTable import SymbolTable, VariableSymbol
 from collections import defaultdict
 
@@ -58,6 +59,45 @@ class TypeChecker(NodeVisitor):
             self.allowed_ops[op]['int']['float'] = 'bool'
             self.allowed_ops[op]['float']['int'] = 'bool'
             self.allowed_ops[op]['float']['float'] = 'bool'
+            # element by element on matrices, giving a mask of where it holds
+            for kind in ('matrix', 'vector'):
+                self.allowed_ops[op][kind][kind] = 'mask'
+                for scalar in ('int', 'float'):
+                    self.allowed_ops[op][kind][scalar] = 'mask'
+                    self.allowed_ops[op][scalar][kind] = 'mask'
+
+        matrix_ops = ['.+', '.-', '.*', './']
+        for op in matrix_ops:
+            self.allowed_ops[op]['matrix']['matrix'] = 'matrix'
+            self.allowed_ops[op]['vector']['vector'] = 'vector'
+            # a number applies to every element
+            for kind in ('matrix', 'vector'):
+                for scalar in ('int', 'float'):
+                    self.allowed_ops[op][kind][scalar] = kind
+                    self.allowed_ops[op][scalar][kind] = kind
+
+        # matrix product, a vector is a single row
+        self.allowed_ops['*']['matrix']['matrix'] = 'matrix'
+        self.allowed_ops['*']['matrix']['vector'] = 'matrix'
+        self.allowed_ops['*']['vector']['matrix'] = 'vector'
+        self.allowed_ops['*']['vector']['vector'] = 'vector'
+        # + and - element by element, also with a number; / divides by a
+        # number or element by element, which A += B and A /= 2 do as well
+        for kind in ('matrix', 'vector'):
+            for op in ('+', '-', '/'):
+                self.allowed_ops[op][kind][kind] = kind
+            for scalar in ('int', 'float'):
+                self.allowed_ops['+'][kind][scalar] = kind
+                self.allowed_ops['+'][scalar][kind] = kind
+                self.allowed_ops['-'][kind][scalar] = kind
+                self.allowed_ops['-'][scalar][kind] = kind
+                self.allowed_ops['/'][kind][scalar] = kind
+
+        # scaling by a number
+        for kind in ('matrix', 'vector'):
+            for scalar in ('int', 'float'):
+                self.allowed_ops['*'][kind][scalar] = kind
+                self.allowed_ops['*'][scalar][kind] = kind
 
 
     def verify_operation(self, operator, type1, type2, lineno):
@@ -71,12 +111,30 @@ class TypeChecker(NodeVisitor):
             self.visit(stmt)
 
     def visit_Assignment(self, node: AST.Assignment):
-        name = node.var.name
         evaluated_type = self.visit(node.expression)
+        if not isinstance(node.var, AST.Var):
+            self.visit(node.var)
+            masked = isinstance(node.var, AST.VectorRef) and node.var.index.type == "mask"
+            if masked and node.operator != '=' and evaluated_type not in ("int", "float", "matrix"):
+                print(f"[{node.line}]: Error: {node.operator} on masked elements needs a number or a matrix")
+            # storing a float turns a matrix of ints into one of floats
+            symbol = self.current_scope.get(node.var.id.name) if isinstance(node.var.id, AST.Var) else None
+            if symbol is not None and symbol.element == "int" and \
+                    self._element(node.operator[0], node.var, node.expression) != "int":
+                symbol.element = "float"
+            return
 
-        if evaluated_type in ["vector", "matrix"]:
-            dimensions = getattr(node.expression, "dims", None)
-            self.global_scope.put(name, VariableSymbol(name, evaluated_type, size=dimensions))
+        name = node.var.name
+        dimensions = getattr(node.expression, "size", None)
+        element = node.expression.element
+        if node.operator != '=':
+            evaluated_type = self.verify_operation(node.operator[0], self.visit(node.var), evaluated_type, node.line)
+            if evaluated_type in ("matrix", "vector"):
+                dimensions = self._operation_size(node.operator[0], node.var, node.expression, node.line)
+                element = self._element(node.operator[0], node.var, node.expression)
+
+        if evaluated_type in ["vector", "matrix", "mask"]:
+            self.global_scope.put(name, VariableSymbol(name, evaluated_type, size=dimensions, element=element))
         else:
             self.global_scope.put(name, VariableSymbol(name, evaluated_type))
 
@@ -91,8 +149,68 @@ class TypeChecker(NodeVisitor):
         result = self.verify_operation(node.operator, left, right, node.line)
         if result is None:
             print(f"[{node.line}]: Error in binary operation {left} {node.operator} {right}")
+        elif result in ("matrix", "vector"):
+            node.size = self._operation_size(node.operator, node.left, node.right, node.line)
+            node.element = self._element(node.operator, node.left, node.right)
+        node.type = result
         return result
 
+    def visit_Condition(self, node: AST.Condition):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        node.type = self.verify_operation(node.operator, left, right, node.line)
+        if node.type == "mask":
+            node.size = node.left.size if left in ("matrix", "vector") else node.right.size
+        return node.type
+
+    def visit_FunctionCall(self, node: AST.FunctionCall):
+        builtin = functions.get(node.name)
+        types = [self._argument(arg) for arg in node.args]
+        if builtin is None:
+            print(f"[{node.line}]: Error: Undefined function {node.name}")
+            return None
+        if len(types) not in builtin.arities:
+            print(f"[{node.line}]: Error: {node.name} takes {' or '.join(map(str, builtin.arities))} arguments")
+            return None
+        node.type = builtin.signature(types)
+        if node.type is None:
+            print(f"[{node.line}]: Error: Invalid arguments {', '.join(map(str, types))} for {node.name}")
+            return None
+        sizes = [arg.size for arg in node.args]
+        if builtin.shape is not None and None not in sizes:
+            try:
+                size = builtin.shape(sizes)
+            except ValueError as error:
+                print(f"[{node.line}]: Error: {node.name}: {error}")
+                return node.type
+        else:
+            size = next((arg.size for arg in node.args if arg.type == node.type), None)
+        if node.type in ("matrix", "vector"):
+            node.size = size
+        return node.type
+
+    def visit_Uminus(self, node: AST.Uminus):
+        node.type = self.visit(node.right)
+        node.size = node.right.size
+        node.element = node.right.element
+        return node.type
+
+    def visit_String(self, node: AST.String):
+        node.type = "string"
+        return node.type
+
+    def visit_MatrixFunction(self, node: AST.MatrixFunction):
+        for arg in node.args:
+            if self.visit(arg) != "int":
+                print(f"[{node.line}]: Error: {node.name} arguments must be of type int")
+                return None
+        node.type = "matrix"
+        node.element = "int"
+        if all(isinstance(arg, AST.Number) for arg in node.args):
+            sizes = [int(arg.value) for arg in node.args]
+            node.size = (sizes[0], sizes[-1])
+        return node.type
+
     def visit_Number(self, node: AST.Number):
         if "." in str(node.value):
             node.type = "float"
@@ -121,6 +239,8 @@ class TypeChecker(NodeVisitor):
 
         node.type = "vector"
         node.size = (1, len(node.vector))
+        node.element = node.vector[0].type if node.vector[0].type in ("int", "float") else None
+        return node.type
 
     def visit_Matrix(self, node):
         if not isinstance(node.matrix, list):
@@ -144,6 +264,8 @@ class TypeChecker(NodeVisitor):
 
         node.type = "matrix"
         node.size = (len(node.matrix), initial_size[1])
+        node.element = self._element(None, *node.matrix)
+        return node.type
 
     def visit_MatrixRef(self, node):
         self.visit(node.row_index)
@@ -154,12 +276,34 @@ class TypeChecker(NodeVisitor):
             print(f"[{node.line}]: Error: Variable is not a matrix")
             return
 
-        self._validate_index(node.row_index, node.id.size[0], node.line, "row")
-        self._validate_index(node.col_index, node.id.size[1], node.line, "column")
+        if node.id.size is not None:
+            self._validate_index(node.row_index, node.id.size[0], node.line, "row")
+            self._validate_index(node.col_index, node.id.size[1], node.line, "column")
+        if isinstance(node.row_index, AST.Range) or isinstance(node.col_index, AST.Range):
+            node.type = "matrix"
+            rows, cols = (self._extent(index) for index in (node.row_index, node.col_index))
+            node.size = (rows, cols) if None not in (rows, cols) else None
+            node.element = node.id.element
+        else:
+            node.type = self._scalar(node.id)
+        return node.type
 
     def visit_VectorRef(self, node):
+        if not isinstance(node.index, (AST.Number, AST.Range)) and self.visit(node.index) == "mask":
+            self.visit(node.id)
+            if node.id.type not in ("matrix", "vector"):
+                print(f"[{node.line}]: Error: Only a matrix or a vector can be masked")
+                return
+            if node.id.size is not None and node.index.size is not None and node.id.size != node.index.size:
+                print(f"[{node.line}]: Error: Mask of size {node.index.size} on a matrix of size {node.id.size}")
+            # the selected elements, as many as the mask holds
+            node.type = "vector"
+            node.size = None
+            node.element = node.id.element
+            return node.type
+
         if not isinstance(node.index, AST.Number) and not isinstance(node.index, AST.Range):
-            print(f"[{node.line}]: Error: Vector index must be a number or a range")
+            print(f"[{node.line}]: Error: Vector index must be a number, a range or a mask")
             return
 
         self.visit(node.index)
@@ -169,17 +313,39 @@ class TypeChecker(NodeVisitor):
             print(f"[{node.line}]: Error: Variable is not a vector")
             return
 
-        self._validate_index(node.index, node.id.size[1], node.line, "vector index")
+        if node.id.size is not None:
+            self._validate_index(node.index, node.id.size[1], node.line, "vector index")
+        if isinstance(node.index, AST.Range):
+            node.type = "vector"
+            length = self._extent(node.index)
+            node.size = (1, length) if length is not None else None
+            node.element = node.id.element
+        else:
+            node.type = self._scalar(node.id)
+        return node.type
+
+    def visit_Range(self, node: AST.Range):
+        # a slice of indices, from left up to but not including right
+        if self.visit(node.left) != "int" or self.visit(node.right) != "int":
+            print(f"[{node.line}]: Error: Range bounds must be of type int")
+            return None
+        node.type = "range"
+        if isinstance(node.left, AST.Number) and isinstance(node.right, AST.Number):
+            node.size = (1, max(0, node.right.constant - node.left.constant))
+        return node.type
 
     def visit_Var(self, node: AST.Var):
         if not isinstance(node.name, str):
             print(f"[{node.line}]: Error: Variable name must be a string")
             return None
 
-        symbol = self.global_scope.get(node.name)
+        symbol = self.current_scope.get(node.name)
         if symbol is None:
             print(f"Undefined variable {node.name} (line {node.line})")
             return None
+        node.type = symbol.type
+        node.size = symbol.size
+        node.element = symbol.element
         return symbol.type
 
     def visit_Transposition(self, node: AST.Transposition):
@@ -189,32 +355,36 @@ class TypeChecker(NodeVisitor):
             return
 
         node.type = node.matrix.type
-        node.size = (node.matrix.size[1], node.matrix.size[0])
+        node.element = node.matrix.element
+        # the shape is unknown for the elements a mask selects
+        size = node.matrix.size
+        node.size = (size[1], size[0]) if size is not None else None
+        return node.type
 
     def visit_While(self, node: AST.While):
-        self.symbol_table = self.global_scope.pushScope("while")
+        self.current_scope = self.current_scope.pushScope("while")
         self.loop_depth += 1
-        self.visit(node.cond)
+        self._check_condition(node.cond, node.line)
         self.visit(node.instr)
-        self.global_scope = self.symbol_table.popScope()
+        self.current_scope = self.current_scope.popScope()
         self.loop_depth -= 1
 
     def visit_For(self, node: AST.For):
         self.current_scope = self.current_scope.pushScope('for')
         self.loop_depth += 1
-        t1 = self.visit(node.cond_start)
-        t2 = self.visit(node.cond_end)
+        t1 = self.visit(node.range.left)
+        t2 = self.visit(node.range.right)
 
         if t1 is None or t2 is None or t1 != "int" or t2 != "int":
-            print(f"[{node.lineno}]: Error: Operand types in for loop range must be 'int'")
-            self.current_scope.put(node.id, None)
+            print(f"[{node.line}]: Error: Operand types in for loop range must be 'int'")
+            self.current_scope.put(node.var.name, None)
         else:
-            if isinstance(node.id, AST.Var):
-                self.current_scope.put(node.id.name, VariableSymbol(node.id.name, t1))
+            if isinstance(node.var, AST.Var):
+                self.current_scope.put(node.var.name, VariableSymbol(node.var.name, t1))
             else:
-                print(f"[{node.lineno}]: Error: Invalid loop variable")
+                print(f"[{node.line}]: Error: Invalid loop variable")
 
-        self.visit(node.body)
+        self.visit(node.instr)
 
         self.current_scope = self.current_scope.popScope()
         self.loop_depth -= 1
@@ -240,7 +410,7 @@ class TypeChecker(NodeVisitor):
                 print(f"[{node.line}]: Print error: invalid expression")
 
     def visit_Ifelse(self, node: AST.Ifelse):
-        self.visit(node.cond)
+        self._check_condition(node.cond, node.line)
 
         self.current_scope = self.current_scope.pushScope("if")
         self.visit(node.instr)
@@ -251,25 +421,81 @@ class TypeChecker(NodeVisitor):
         self.current_scope = self.current_scope.popScope()
 
     def visit_If(self, node: AST.If):
-        self.visit(node.cond)
+        self._check_condition(node.cond, node.line)
 
         self.current_scope = self.current_scope.pushScope("if")
         self.visit(node.instr)
         self.current_scope = self.current_scope.popScope()
 
+    def _argument(self, arg):
+        # a range stands for the vector of its values
+        if not isinstance(arg, AST.Range):
+            return self.visit(arg)
+        if self.visit(arg.left) != "int" or self.visit(arg.right) != "int":
+            print(f"[{arg.line}]: Error: Range bounds must be of type int")
+            return None
+        arg.type = "vector"
+        arg.element = "int"
+        if isinstance(arg.left, AST.Number) and isinstance(arg.right, AST.Number):
+            arg.size = (1, int(arg.right.value) - int(arg.left.value) + 1)
+        return arg.type
+
+    def _extent(self, index):
+        # how many rows or columns an index selects, None when not known
+        if isinstance(index, AST.Range):
+            return index.size[1] if index.size is not None else None
+        return 1
+
+    def _scalar(self, matrix):
+        # the type of an element, an int only when the matrix is known to
+        # hold ints
+        return "int" if matrix.element == "int" else "float"
+
+    def _element(self, operator, *operands):
+        # the element type of a matrix computed from the operands, a number
+        # standing for itself; division always gives floats
+        elements = [operand.type if operand.type in ("int", "float") else operand.element for operand in operands]
+        if None in elements:
+            return None
+        if "float" in elements or operator in ('/', './'):
+            return "float"
+        return "int"
+
+    def _check_condition(self, cond, line):
+        if self.visit(cond) == "mask":
+            print(f"[{line}]: Error: Condition is a mask, reduce it with any or all")
+
     def _validate_index(self, index, size_limit, line, index_type):
         if isinstance(index, AST.Range):
             if not isinstance(index.left, AST.Number) or not isinstance(index.right, AST.Number):
                 print(f"[{line}]: Error: {index_type.capitalize()} range must consist of numbers")
                 return
-            if index.left.value < 0 or index.right.value > size_limit:
+            if int(index.left.value) < 0 or int(index.right.value) > size_limit:
                 print(f"[{line}]: Error: {index_type.capitalize()} out of bounds")
         elif isinstance(index, AST.Number):
             if index.type != "int":
                 print(f"[{line}]: Error: {index_type.capitalize()} must be of type int")
-            elif index.value < 0 or index.value >= size_limit:
+            elif int(index.value) < 0 or int(index.value) >= size_limit:
                 print(f"[{line}]: Error: {index_type.capitalize()} out of bounds")
         else:
             print(f"[{line}]: Error: Invalid {index_type.capitalize()} type")
 
-
+    def _operation_size(self, operator, left, right, line):
+        # the size of a matrix result, the product's or the matrix operand's
+        # when the other is a number
+        if left.type not in ("matrix", "vector"):
+            return right.size
+        if right.type not in ("matrix", "vector"):
+            return left.size
+        if operator == '*':
+            return self._product_size(left.size, right.size, line)
+        return left.size
+
+    def _product_size(self, left_size, right_size, line):
+        if left_size is None or right_size is None:
+            return None
+        if left_size[1] != right_size[0]:
+            print(f"[{line}]: Error: Matrix product of {left_size[0]}x{left_size[1]} "
+                  f"and {right_size[0]}x{right_size[1]} requires matching inner dimensions")
+            return None
+        return (left_size[0], right_size[1])
@@ -0,0 +1,508 @@
+import AST
+from functools import partial
+from Exceptions import *
+from visit import *
+import numpy as np
+from Interpreter import operations, multiply, negate, mat_add, mat_sub, mat_mul, mat_div, matrix_creators
+from Interpreter import scalar, item, submatrix, assign, augment, share, transpose, printable
+from Resolver import Resolver, walk
+from Fusion import evaluate
+from Builtins import functions, sequence
+from Memory import UNSET
+
+# Every instruction is a tuple (op, a, b, c). Operands are register numbers
+# unless noted otherwise: the *K opcodes carry their constant in c, jumps and
+# IF* tests carry the target instruction in c, CALL carries the function in b
+# and a tuple of argument registers in c.
+(MOVE, ADD, SUB, MUL, DIV, ADDK, SUBK, MULK, DIVK,
+ IFLT, IFGT, IFLE, IFGE, IFEQ, IFNE, JMP, FORLOOP,
+ SELECT, STORE, CALL, SETITEM, PRINT, RETURN, RAISE, HALT) = range(25)
+
+opnames = ['MOVE', 'ADD', 'SUB', 'MUL', 'DIV', 'ADDK', 'SUBK', 'MULK', 'DIVK',
+           'IFLT', 'IFGT', 'IFLE', 'IFGE', 'IFEQ', 'IFNE', 'JMP', 'FORLOOP',
+           'SELECT', 'STORE', 'CALL', 'SETITEM', 'PRINT', 'RETURN', 'RAISE', 'HALT']
+
+arithmetic = {'+': ADD, '-': SUB, '*': MUL, '/': DIV}
+arithmetic_constant = {'+': ADDK, '-': SUBK, '*': MULK, '/': DIVK}
+comparisons = {'<': IFLT, '>': IFGT, '<=': IFLE, '>=': IFGE, '==': IFEQ, '!=': IFNE}
+
+calls = {
+    '.+': mat_add,
+    '.-': mat_sub,
+    '.*': mat_mul,
+    './': mat_div,
+}
+# comparisons that give a value rather than a jump, masks of matrices
+calls.update((operator, operations[operator]) for operator in comparisons)
+
+
+def make_array(*elements):
+    return np.array(elements)
+
+
+def get_item(matrix, i, j=None):
+    return item(matrix, i) if j is None else scalar(matrix[i, j])
+
+
+def vector_slice(vector, start, stop):
+    return vector[start:stop].copy()
+
+
+def cells(index, stop=None):
+    return [index] if stop is None else range(index, stop)
+
+
+def matrix_function(name):
+    create = matrix_creators[name]
+    return lambda *args: create(list(args))
+
+
+class Chunk(object):
+    def __init__(self, code, registers, lines):
+        self.code = code
+        self.registers = registers
+        self.lines = lines
+
+    def disassemble(self):
+        return '\n'.join(f'{pc:4} [{self.lines[pc]:3}] {opnames[op]:8} {a} {b} {c}'
+                         for pc, (op, a, b, c) in enumerate(self.code))
+
+
+# Compiles a program to register bytecode. Every variable slot found by the
+# Resolver is a register, literals sit in registers filled before the run and
+# temporaries are stacked above them, released at the end of each statement.
+# Loops and break/continue are plain jumps.
+class BytecodeCompiler(object):
+    def __init__(self):
+        self.code = []
+        self.lines = []
+        self.constants = {}
+        self.loops = []
+        self.line = 0
+
+    def compile(self, program):
+        scopes = Resolver().resolve(program)
+        registers = [None] * sum(len(scope.symbols) for scope in scopes)
+        for node in walk(program):
+            if isinstance(node, (AST.Number, AST.String)):
+                value = self.literal(node)
+                if (type(value), value) not in self.constants:
+                    self.constants[(type(value), value)] = len(registers)
+                    registers.append(value)
+        self.none = len(registers)
+        self.unset = self.none + 1
+        self.true = self.none + 2
+        registers += [None, UNSET, True]
+        self.top = self.size = len(registers)
+
+        self.line = program.line
+        self.enter(program.scope)
+        program.accept(self)
+        self.emit(HALT)
+        return Chunk(self.code, registers + [None] * (self.size - len(registers)), self.lines)
+
+    @staticmethod
+    def literal(node):
+        if isinstance(node, AST.String):
+            return str(node.string)[1:-1]
+        return node.constant
+
+    def emit(self, op, a=0, b=0, c=0):
+        self.code.append((op, a, b, c))
+        self.lines.append(self.line)
+        return len(self.code) - 1
+
+    def patch(self, pc, target):
+        op, a, b, c = self.code[pc]
+        self.code[pc] = (op, a, b, target)
+
+    def temp(self):
+        self.top += 1
+        self.size = max(self.size, self.top)
+        return self.top - 1
+
+    def enter(self, scope):
+        for symbol in scope.symbols.values():
+            if symbol.used:
+                self.emit(MOVE, symbol.index, self.unset if symbol.guarded else self.none)
+
+    def move(self, dst, src):
+        if dst != src:
+            self.emit(MOVE, dst, src)
+        return dst
+
+    def read(self, binding, dst=None):
+        symbols = binding.symbols
+        if not symbols:
+            return self.none if dst is None else self.move(dst, self.none)
+        if binding.static or (len(symbols) == 1 and not symbols[0].guarded):
+            return symbols[0].index if dst is None else self.move(dst, symbols[0].index)
+        dst = self.temp() if dst is None else dst
+        if binding.bound:
+            self.emit(SELECT, dst, tuple(symbol.index for symbol in symbols[:-1]), symbols[-1].index)
+        else:
+            self.emit(SELECT, dst, tuple(symbol.index for symbol in symbols), self.none)
+        return dst
+
+    def store(self, binding, src):
+        symbols = binding.symbols
+        if len(symbols) == 1:
+            self.move(symbols[0].index, src)
+        else:
+            self.emit(STORE, src, tuple(symbol.index for symbol in symbols[:-1]), symbols[-1].index)
+
+    def expression(self, node, dst=None):
+        return self.visit(node, dst)
+
+    def statement(self, node):
+        top, line = self.top, self.line
+        self.line = node.line
+        node.accept(self)
+        self.top, self.line = top, line
+
+    def block(self, node, scope=None):
+        if scope is not None:
+            self.enter(scope)
+        self.statement(node)
+
+    def jump_unless(self, cond):
+        top = self.top
+        if not isinstance(cond, AST.Condition):
+            truth = self.call(None, bool, self.expression(cond))
+            self.top = top
+            return self.emit(IFEQ, truth, self.true, None)
+        left = self.expression(cond.left)
+        right = self.expression(cond.right)
+        self.top = top
+        return self.emit(comparisons[cond.operator], left, right, None)
+
+    def binary(self, operator, left, right_node, dst, top):
+        # the result register is picked after the operands are released, it
+        # may reuse one of them because an instruction reads before it writes
+        if operator in arithmetic and isinstance(right_node, AST.Number):
+            self.top = top
+            dst = self.temp() if dst is None else dst
+            self.emit(arithmetic_constant[operator], dst, left, self.literal(right_node))
+            return dst
+        right = self.expression(right_node)
+        self.top = top
+        dst = self.temp() if dst is None else dst
+        if operator in arithmetic:
+            self.emit(arithmetic[operator], dst, left, right)
+        else:
+            self.emit(CALL, dst, calls[operator], (left, right))
+        return dst
+
+    def call(self, dst, function, *args):
+        dst = self.temp() if dst is None else dst
+        self.emit(CALL, dst, function, args)
+        return dst
+
+    @on('node')
+    def visit(self, node, dst=None):
+        pass
+
+    @when(AST.Instructions)
+    def visit(self, node: AST.Instructions, dst=None):
+        for instruction in node.instructions:
+            self.statement(instruction)
+
+    @when(AST.BinaryExpression)
+    def visit(self, node: AST.BinaryExpression, dst=None):
+        top = self.top
+        return self.binary(node.operator, self.expression(node.left), node.right, dst, top)
+
+    @when(AST.Condition)
+    def visit(self, node: AST.Condition, dst=None):
+        top = self.top
+        return self.binary(node.operator, self.expression(node.left), node.right, dst, top)
+
+    @when(AST.Transposition)
+    def visit(self, node: AST.Transposition, dst=None):
+        return self.call(dst, transpose, self.expression(node.matrix))
+
+    @when(AST.Uminus)
+    def visit(self, node: AST.Uminus, dst=None):
+        return self.call(dst, negate, self.expression(node.right))
+
+    @when(AST.Elementwise)
+    def visit(self, node: AST.Elementwise, dst=None):
+        tree = node.tree
+        leaves = [self.expression(leaf) for leaf in node.leaves]
+        if node.dead is not None:
+            return self.call(dst, lambda *values: evaluate(tree, values[:-1], values[-1]), *leaves, self.read(node.dead))
+        return self.call(dst, lambda *values: evaluate(tree, values), *leaves)
+
+    @when(AST.Var)
+    def visit(self, node: AST.Var, dst=None):
+        return self.read(node.binding, dst)
+
+    @when(AST.Number)
+    def visit(self, node: AST.Number, dst=None):
+        value = self.literal(node)
+        src = self.constants[(type(value), value)]
+        return src if dst is None else self.move(dst, src)
+
+    @when(AST.String)
+    def visit(self, node: AST.String, dst=None):
+        value = self.literal(node)
+        src = self.constants[(type(value), value)]
+        return src if dst is None else self.move(dst, src)
+
+    @when(AST.If)
+    def visit(self, node: AST.If, dst=None):
+        skip = self.jump_unless(node.cond)
+        self.block(node.instr, node.scope)
+        self.patch(skip, len(self.code))
+
+    @when(AST.Ifelse)
+    def visit(self, node: AST.Ifelse, dst=None):
+        skip = self.jump_unless(node.cond)
+        self.block(node.instr, node.scope)
+        done = self.emit(JMP, c=None)
+        self.patch(skip, len(self.code))
+        self.block(node.instr_else, node.else_scope)
+        self.patch(done, len(self.code))
+
+    @when(AST.While)
+    def visit(self, node: AST.While, dst=None):
+        self.enter(node.scope)
+        start = len(self.code)
+        exit = self.jump_unless(node.cond)
+        # a loop records the jumps to patch for break, and the continue target
+        self.loops.append(([exit], start))
+        self.block(node.instr)
+        self.emit(JMP, c=start)
+        self.close_loop([])
+
+    @when(AST.For)
+    def visit(self, node: AST.For, dst=None):
+        first = self.expression(node.range.left)
+        last = self.temp()
+        self.expression(node.range.right, last)
+        self.enter(node.scope)
+        if len(node.var.binding.symbols) == 1:
+            # the counter has one register: test once, then FORLOOP does i += 1; i <= last
+            counter = node.var.binding.symbols[0].index
+            self.move(counter, first)
+            exit = self.emit(IFLE, counter, last, None)
+            start = len(self.code)
+            self.loops.append(([exit], []))
+            self.block(node.instr)
+            self.close_loop([self.emit(FORLOOP, counter, last, start)])
+        else:
+            self.store(node.var.binding, first)
+            start = len(self.code)
+            exit = self.emit(IFLE, self.read(node.binding), last, None)
+            self.loops.append(([exit], []))
+            self.block(node.instr)
+            step = self.temp()
+            increment = self.emit(ADDK, step, self.read(node.binding), 1)
+            self.store(node.binding, step)
+            self.emit(JMP, c=start)
+            self.close_loop([increment])
+
+    def close_loop(self, continue_target):
+        breaks, continues = self.loops.pop()
+        for pc in breaks:
+            self.patch(pc, len(self.code))
+        if isinstance(continues, list):
+            for pc in continues:
+                self.patch(pc, continue_target[0])
+
+    @when(AST.Return)
+    def visit(self, node: AST.Return, dst=None):
+        self.emit(RETURN, self.expression(node.expression))
+
+    @when(AST.Break)
+    def visit(self, node: AST.Break, dst=None):
+        if not self.loops:
+            self.emit(RAISE, BreakException)
+        else:
+            self.loops[-1][0].append(self.emit(JMP, c=None))
+
+    @when(AST.Continue)
+    def visit(self, node: AST.Continue, dst=None):
+        if not self.loops:
+            self.emit(RAISE, ContinueException)
+        elif isinstance(self.loops[-1][1], int):
+            self.emit(JMP, c=self.loops[-1][1])
+        else:
+            self.loops[-1][1].append(self.emit(JMP, c=None))
+
+    @when(AST.Print)
+    def visit(self, node: AST.Print, dst=None):
+        values = tuple(self.expression(value) for value in node.to_print.values)
+        self.emit(PRINT, values)
+
+    @when(AST.Assignment)
+    def visit(self, node: AST.Assignment, dst=None):
+        operator = None if node.operator == '=' else node.operator[0]
+        if isinstance(node.var, AST.Var):
+            binding = node.var.binding
+            single = len(binding.symbols) == 1
+            dst = binding.symbols[0].index if single else self.temp()
+            if operator is None:
+                self.expression(node.expression, dst)
+                if node.shares:
+                    self.call(dst, share, dst)
+            elif node.inplace:
+                top = self.top
+                target = self.read(binding)
+                value = self.expression(node.expression)
+                self.top = top
+                self.call(dst, partial(augment, operator), target, value)
+            else:
+                top = self.top
+                self.binary(operator, self.read(binding), node.expression, dst, top)
+            if not single:
+                self.store(binding, dst)
+            return
+
+        matrix = self.expression(node.var.id)
+        if isinstance(node.var, AST.VectorRef):
+            region = (self.index(node.var.index),)
+        else:
+            region = (self.index(node.var.row_index), self.index(node.var.col_index))
+        value = self.expression(node.expression)
+        self.emit(SETITEM, matrix, (value, operator), region)
+        if matrix not in [symbol.index for symbol in node.var.id.binding.symbols]:
+            # SETITEM leaves a widened or copied matrix in the register it read
+            self.store(node.var.id.binding, matrix)
+
+    def index(self, index):
+        if isinstance(index, AST.Range):
+            return self.call(None, slice, self.expression(index.left), self.expression(index.right))
+        return self.expression(index)
+
+    def index_range(self, index):
+        if isinstance(index, AST.Range):
+            return self.call(None, cells, self.expression(index.left), self.expression(index.right))
+        return self.call(None, cells, self.expression(index))
+
+    @when(AST.Matrix)
+    def visit(self, node: AST.Matrix, dst=None):
+        return self.call(dst, make_array, *[self.expression(row) for row in node.matrix])
+
+    @when(AST.Vector)
+    def visit(self, node: AST.Vector, dst=None):
+        return self.call(dst, make_array, *[self.expression(element) for element in node.vector])
+
+    @when(AST.VectorRef)
+    def visit(self, node: AST.VectorRef, dst=None):
+        vector = self.expression(node.id)
+        if isinstance(node.index, AST.Range):
+            start = self.expression(node.index.left)
+            return self.call(dst, vector_slice, vector, start, self.expression(node.index.right))
+        return self.call(dst, get_item, vector, self.expression(node.index))
+
+    @when(AST.MatrixRef)
+    def visit(self, node: AST.MatrixRef, dst=None):
+        matrix = self.expression(node.id)
+        if isinstance(node.row_index, AST.Range) or isinstance(node.col_index, AST.Range):
+            rows = self.index_range(node.row_index)
+            return self.call(dst, submatrix, matrix, rows, self.index_range(node.col_index))
+        row = self.expression(node.row_index)
+        return self.call(dst, get_item, matrix, row, self.expression(node.col_index))
+
+    @when(AST.MatrixFunction)
+    def visit(self, node: AST.MatrixFunction, dst=None):
+        return self.call(dst, matrix_function(node.name), *[self.expression(arg) for arg in node.args])
+
+    @when(AST.FunctionCall)
+    def visit(self, node: AST.FunctionCall, dst=None):
+        function = functions[node.name].function
+        args = [self.call(None, sequence, self.expression(arg.left), self.expression(arg.right))
+                if isinstance(arg, AST.Range) else self.expression(arg) for arg in node.args]
+        return self.call(dst, lambda *args: function(list(args)), *args)
+
+
+class VM(object):
+    def run(self, program):
+        self.execute(BytecodeCompiler().compile(program))
+
+    def execute(self, chunk):
+        code = chunk.code
+        regs = list(chunk.registers)
+        pc = 0
+        try:
+            while True:
+                op, a, b, c = code[pc]
+                pc += 1
+                if op == ADDK:
+                    regs[a] = regs[b] + c
+                elif op == FORLOOP:
+                    regs[a] += 1
+                    if regs[a] <= regs[b]:
+                        pc = c
+                elif op == MOVE:
+                    regs[a] = regs[b]
+                elif op == ADD:
+                    regs[a] = regs[b] + regs[c]
+                elif op == SUB:
+                    regs[a] = regs[b] - regs[c]
+                elif op == MUL:
+                    left, right = regs[b], regs[c]
+                    if left.__class__ is np.ndarray and right.__class__ is np.ndarray:
+                        regs[a] = multiply(left, right)
+                    else:
+                        regs[a] = left * right
+                elif op == DIV:
+                    regs[a] = regs[b] / regs[c]
+                elif op == SUBK:
+                    regs[a] = regs[b] - c
+                elif op == MULK:
+                    regs[a] = regs[b] * c
+                elif op == DIVK:
+                    regs[a] = regs[b] / c
+                elif op == IFLT:
+                    if not regs[a] < regs[b]:
+                        pc = c
+                elif op == IFGT:
+                    if not regs[a] > regs[b]:
+                        pc = c
+                elif op == IFLE:
+                    if not regs[a] <= regs[b]:
+                        pc = c
+                elif op == IFGE:
+                    if not regs[a] >= regs[b]:
+                        pc = c
+                elif op == IFEQ:
+                    if not regs[a] == regs[b]:
+                        pc = c
+                elif op == IFNE:
+                    if not regs[a] != regs[b]:
+                        pc = c
+                elif op == JMP:
+                    pc = c
+                elif op == CALL:
+                    regs[a] = b(*[regs[r] for r in c])
+                elif op == SELECT:
+                    for r in b:
+                        if regs[r] is not UNSET:
+                            regs[a] = regs[r]
+                            break
+                    else:
+                        regs[a] = regs[c]
+                elif op == STORE:
+                    for r in b:
+                        if regs[r] is not UNSET:
+                            regs[r] = regs[a]
+                            break
+                    else:
+                        regs[c] = regs[a]
+                elif op == SETITEM:
+                    region = regs[c[0]] if len(c) == 1 else (regs[c[0]], regs[c[1]])
+                    regs[a] = assign(regs[a], region, regs[b[0]], b[1])
+                elif op == PRINT:
+                    print(*[printable(regs[r]) for r in a], sep=' ')
+                elif op == RETURN:
+                    raise ReturnValueException(regs[a])
+                elif op == RAISE:
+                    raise a()
+                elif op == HALT:
+                    return regs
+        except Exception as e:
+            e.add_note(f'line {chunk.lines[pc - 1]}')
+            raise
+
@@ -0,0 +1,327 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import AST
+from parser import Mparser
+from scanner import Scanner
+from main5 import engines
+from MatrixChain import MatrixChainOptimizer
+from Fusion import fuse
+from TypeChecker import TypeChecker
+from Memory import FrameStack
+from Resolver import Resolver
+from IR import PassManager
+from Optimizations import ConstantPropagation, DeadCodeElimination, LoopInvariantCodeMotion, StrengthReduction
+
+
+def parse(path):
+    with open(path, 'r') as file:
+        return Mparser().parse(Scanner().tokenize(file.read()))
+
+
+def run_quietly(program, engine='interpreter'):
+    # codegen runs without source, so every run pays for code generation
+    with contextlib.redirect_stdout(io.StringIO()):
+        engines[engine](program)
+
+
+def count_nodes(program):
+    # every evaluated node goes through Node.accept exactly once
+    counter = [0]
+    accept = AST.Node.accept
+
+    def counting_accept(node, visitor):
+        counter[0] += 1
+        return visitor.visit(node)
+
+    AST.Node.accept = counting_accept
+    try:
+        run_quietly(program)
+    finally:
+        AST.Node.accept = accept
+    return counter[0]
+
+
+def allocations(program, engine, elide):
+    # frames pushed and the tracemalloc peak of one run, with frames of
+    # blocks that introduce no variables elided or pushed as before
+    counter = [0]
+    push = FrameStack.push
+
+    def counting_push(memory, scope):
+        counter[0] += 1
+        push(memory, scope)
+
+    FrameStack.push = counting_push
+    Resolver.elide = elide
+    try:
+        tracemalloc.start()
+        run_quietly(program, engine)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        FrameStack.push = push
+        Resolver.elide = True
+    return counter[0], peak
+
+
+def best_time(program, repeat, engine='interpreter'):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_quietly(program, engine)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def elementwise(size, fill=1, repeat=3):
+    # time and peak memory of element-wise operators on size x size matrices
+    # of fill
+    create = f'ones({size})' if fill == 1 else f'ones({size}) .* {fill}'
+    program = Mparser().parse(Scanner().tokenize(f'A = {create}; B = A .+ A; C = A .* B;'))
+    elapsed = best_time(program, repeat)
+    tracemalloc.start()
+    run_quietly(program)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def elementwise_lists(size, fill=1, repeat=3):
+    # the same operators on the lists of lists matrices were stored in
+    # before they became numpy arrays, as the interpreter computed them then
+    def run():
+        a = [[fill] * size for i in range(size)]
+        b = [[a[i][j] + a[i][j] for j in range(len(a[0]))] for i in range(len(a))]
+        return [[a[i][j] * b[i][j] for j in range(len(a[0]))] for i in range(len(a))]
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def fusion(size, repeat=3):
+    # an element-wise tree evaluated node by node and fused, on matrices
+    # allocated before the measurement starts
+    source = f'O = ones({size}); A = O ./ (O .+ O); E = A .+ A .* A ./ A .- A;'
+    results = []
+    for fused in (False, True):
+        program = Mparser().parse(Scanner().tokenize(source))
+        if fused:
+            fuse(program)
+        elapsed = best_time(program, repeat)
+        tracemalloc.start()
+        run_quietly(program)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((elapsed, peak))
+    return results
+
+
+def compound(size, repeat=3):
+    # op= in a loop on a matrix no other variable holds, then on one that
+    # another variable shares and which has to be copied
+    loop = 'for i = 1:20 { A += B; A -= B; A += 1; }'
+    results = []
+    for shared in ('', 'S = A;'):
+        source = f'A = ones({size}); B = ones({size}); {shared} {loop}'
+        program = Mparser().parse(Scanner().tokenize(source))
+        elapsed = best_time(program, repeat)
+        tracemalloc.start()
+        run_quietly(program)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((elapsed, peak))
+    return results
+
+
+def transposition(size, repeat=3):
+    # taking a transposition, then writing to it, which makes the copy
+    setup = f'A = ones({size}) .+ 1;'
+    times = []
+    for source in ("B = A';", "B = A'; B[0, 0] = 0;"):
+        program = Mparser().parse(Scanner().tokenize(setup + source))
+        times.append(best_time(program, repeat))
+    return times
+
+
+def masking(size, repeat=3):
+    # clamping a vector element by element in a loop, and with a mask, less
+    # the time it takes to build the vector
+    setup = 'v = [' + ', '.join(str(i % 10) for i in range(size)) + '];'
+    times = []
+    for source in ('', f'for i = 0:{size - 1} {{ if (v[i] > 5) v[i] = 5; }}', 'v[v > 5] = 5;'):
+        program = Mparser().parse(Scanner().tokenize(setup + source))
+        times.append(best_time(program, repeat))
+    return [elapsed - times[0] for elapsed in times[1:]]
+
+
+def library(repeat=3):
+    # sqrt.m's Newton iterations against sqrt, and a series summed in a
+    # loop against sum over a range
+    pairs = [
+        ('for x = 1:9 { r = 1.0; for i = 1:10000 r = (r + x / r) / 2; print x, r; }',
+         'for x = 1:9 print x, sqrt(x);'),
+        ('s = 0.0; for i = 1:100000 s += sqrt(i); print s;',
+         'print sum(sqrt(1:100000));'),
+    ]
+    return [tuple(best_time(Mparser().parse(Scanner().tokenize(source)), repeat) for source in pair)
+            for pair in pairs]
+
+
+def linear_system(size, repeat=3):
+    # Gaussian elimination and back substitution written in the language
+    # against solve, on a diagonally dominant system; both print x, and
+    # the time it takes to build the system is left out
+    rows = ', '.join('[' + ', '.join(str(size * 10 if i == j else (i * 7 + j * 3) % 10) for j in range(size)) + ']'
+                     for i in range(size))
+    setup = f'A = [{rows}]; b = [' + ', '.join(str(i % 5 + 1) for i in range(size)) + '];'
+    loop = f"""
+        for k = 0:{size - 2} {{
+            pivot = A[k];
+            for i = k + 1:{size - 1} {{
+                row = A[i];
+                f = row[k] / pivot[k];
+                for j = k:{size - 1} row[j] -= f * pivot[j];
+                A[i] = row;
+                b[i] -= f * b[k];
+            }}
+        }}
+        x = b .* 1.0;
+        i = {size - 1};
+        while (i >= 0) {{
+            row = A[i];
+            s = b[i];
+            for j = i + 1:{size - 1} s -= row[j] * x[j];
+            x[i] = s / row[i];
+            i -= 1;
+        }}
+        print x;
+    """
+    times = [best_time(Mparser().parse(Scanner().tokenize(setup + source)), repeat)
+             for source in ('', loop, 'print solve(A, b);')]
+    return [elapsed - times[0] for elapsed in times[1:]]
+
+
+def propagation(repeat=3):
+    # a loop over expressions of constants and a branch on one, as written
+    # and after constant propagation and dead code elimination
+    source = ('n = 10; debug = 0; s = 0; '
+              'for i = 1:100000 { m = n * 4 + 2; if (debug == 1) print m; s += m * i; } print s;')
+    times = []
+    for optimize in (False, True):
+        program = Mparser().parse(Scanner().tokenize(source))
+        TypeChecker().visit(program)
+        if optimize:
+            PassManager([ConstantPropagation(), DeadCodeElimination()]).run(program)
+        times.append(best_time(program, repeat))
+    return times
+
+
+def invariants(repeat=3):
+    # an inner loop over an expression of outer variables only, as written
+    # and with the expression computed once before it
+    source = ('a = 0; for q = 1:3 a += q; s = 0; '
+              'for i = 1:300 { for j = 1:300 { s += (a * i + a) * (i - a) + j; } } print s;')
+    times = []
+    for optimize in (False, True):
+        program = Mparser().parse(Scanner().tokenize(source))
+        TypeChecker().visit(program)
+        if optimize:
+            PassManager([LoopInvariantCodeMotion()]).run(program)
+        times.append(best_time(program, repeat))
+    return times
+
+
+def induction(repeat=3):
+    # products of the counter in a loop, as written and with each replaced
+    # by a variable increased on every iteration
+    source = ('cols = 0; for q = 1:100 cols += 1; s = 0; '
+              'for i = 1:100000 { s += (i * cols + 7) * 2 - i * 3; } print s;')
+    times = []
+    for optimize in (False, True):
+        program = Mparser().parse(Scanner().tokenize(source))
+        TypeChecker().visit(program)
+        if optimize:
+            PassManager([StrengthReduction()]).run(program)
+        times.append(best_time(program, repeat))
+    return times
+
+
+def matrix_chain(repeat=3):
+    # a chain with skewed shapes, as written and after reordering
+    source = 'A = ones(1000, 10); B = ones(10, 1000); C = ones(1000, 10); D = A * B * C;'
+    times = []
+    for optimize in (False, True):
+        program = Mparser().parse(Scanner().tokenize(source))
+        TypeChecker().visit(program)
+        if optimize:
+            MatrixChainOptimizer().optimize(program)
+        times.append(best_time(program, repeat))
+    return times
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--tracemalloc', action='store_true',
+                            help='only report frames pushed and peak memory with and without frame elision')
+    arg_parser.add_argument('files', nargs='*')
+    args = arg_parser.parse_args()
+    if args.tracemalloc:
+        for filename in args.files or ['primes.m']:
+            path = filename if os.path.isfile(filename) else os.path.join('examples', filename)
+            program = parse(path)
+            for engine in ('interpreter', 'closure'):
+                for name, elide in (('every block', False), ('elided', True)):
+                    pushed, peak = allocations(program, engine, elide)
+                    print(f'{filename}, {engine}, {name}: {pushed} frames pushed, {peak:,} bytes peak')
+        sys.exit()
+    files = args.files or ['pi.m', 'primes.m']
+    for filename in files:
+        path = filename if os.path.isfile(filename) else os.path.join('examples', filename)
+        program = parse(path)
+        nodes = count_nodes(program)
+        elapsed = best_time(program, 3)
+        print(f'{filename}: {nodes} nodes in {elapsed:.3f}s, {nodes / elapsed:,.0f} nodes/s')
+        for engine in engines:
+            if engine != 'interpreter':
+                engine_elapsed = best_time(program, 3, engine)
+                print(f'  {engine}: {engine_elapsed:.3f}s, {elapsed / engine_elapsed:.1f}x')
+    for fill in (1, 1.5):
+        for name, measure in (('lists', elementwise_lists), ('ndarray', elementwise)):
+            elapsed, peak = measure(1000, fill)
+            print(f'1000x1000 .+ and .* of {fill}, {name}: {elapsed:.3f}s, {peak / 2 ** 20:.1f} MiB peak')
+    written, reordered = matrix_chain()
+    print(f'1000x10 * 10x1000 * 1000x10: {written * 1000:.2f}ms as written, {reordered * 1000:.2f}ms reordered')
+    for name, (elapsed, peak) in zip(('node by node', 'fused'), fusion(1000)):
+        print(f'A .+ A .* A ./ A .- A, 1000x1000, {name}: {elapsed:.3f}s, {peak / 2 ** 20:.1f} MiB peak')
+    for name, (elapsed, peak) in zip(('owned', 'shared'), compound(1000)):
+        print(f'op= in a loop, 1000x1000, {name}: {elapsed:.3f}s, {peak / 2 ** 20:.1f} MiB peak')
+    view, write = transposition(2000)
+    print(f"A' of 2000x2000: {view:.3f}s, written to: {write:.3f}s")
+    looped, masked = masking(10000)
+    print(f'clamping 10000 elements: {looped * 1000:.2f}ms in a loop, {masked * 1000:.2f}ms with a mask')
+    for name, (looped, builtin) in zip(('square roots of 1..9', 'sum of sqrt(i), 100000 terms'), library()):
+        print(f'{name}: {looped:.3f}s in a loop, {builtin * 1000:.2f}ms with builtins')
+    looped, solved = linear_system(100)
+    print(f'100x100 linear system: {looped:.3f}s eliminated in a loop, {solved * 1000:.2f}ms with solve')
+    written, optimized = propagation()
+    print(f'constant expressions in a loop: {written:.3f}s as written, {optimized:.3f}s propagated')
+    written, hoisted = invariants()
+    print(f'invariant expression in an inner loop: {written:.3f}s as written, {hoisted:.3f}s hoisted')
+    written, reduced = induction()
+    print(f'products of the counter in a loop: {written:.3f}s as written, {reduced:.3f}s strength-reduced')
@@ -3,15 +3,58 @@ from scanner import Scanner
 from sly.lex import LexError
 from TreePrinter import TreePrinter
 from TypeChecker import TypeChecker
+import argparse
 import os
+import sys
 from Interpreter import Interpreter
+from Compiler import Compiler
+from CodeGenerator import CodeGenerator
+from VM import VM
+from Jit import Jit
+from MatrixChain import MatrixChainOptimizer
+from Fusion import fuse
+from IR import PassManager
+from Optimizations import ConstantPropagation, DeadCodeElimination, LoopInvariantCodeMotion, StrengthReduction
+from Pool import pool
+
+
+def run_jit(program, jit_threshold=50, **context):
+    jit = Jit(jit_threshold)
+    Interpreter(jit=jit).run(program)
+    return jit
+
+
+def default_passes():
+    # the optimizations run unless --no-optimize is given
+    return [ConstantPropagation(), DeadCodeElimination(), LoopInvariantCodeMotion(), StrengthReduction()]
+
+
+engines = {
+    'interpreter': lambda program, **context: Interpreter().run(program),
+    'closure': lambda program, **context: Compiler().run(program),
+    'codegen': lambda program, source=None, passes=(), filename='<m>', cache_dir=None, **context:
+        CodeGenerator().run(program, source, passes, filename, cache_dir),
+    'vm': lambda program, **context: VM().run(program),
+    'jit': run_jit,
+}
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--engine', choices=engines, default='interpreter')
+    arg_parser.add_argument('--cache-dir', help='keep compiled codegen scripts in this directory')
+    arg_parser.add_argument('--jit-threshold', type=int, default=50, help='loop iterations before the jit compiles a loop')
+    arg_parser.add_argument('--dump-ir', action='store_true', help='print the control-flow graph in SSA form')
+    arg_parser.add_argument('--no-optimize', action='store_true', help='run the program as written')
+    arg_parser.add_argument('--report', action='store_true', help='list what the optimizations changed')
+    arg_parser.add_argument('--pool-stats', action='store_true', help='report matrix buffer pool hits and misses')
+    arg_parser.add_argument('files', nargs='*')
+    args = arg_parser.parse_args()
+
     folder_path = 'examples'
-    file_list = os.listdir(folder_path)
-    for filename in file_list:
-        file_path = os.path.join(folder_path, filename)
+    file_list = args.files or [os.path.join(folder_path, filename) for filename in os.listdir(folder_path)]
+    for file_path in file_list:
+        filename = os.path.basename(file_path)
 
         if os.path.isfile(file_path):
             with open(file_path, 'r') as file:
@@ -21,12 +64,29 @@ if __name__ == "__main__":
                 TreePrinter()
                 parser = Mparser()
                 typeChecker = TypeChecker()
-                interpreter = Interpreter()
                 cos = parser.parse(Scanner().tokenize(file_contents))
 
                 if cos is not None:
                     cos.printTree(0)
                     typeChecker.visit(cos)
-                    interpreter.visit(cos)
+                    passes = [] if args.no_optimize else default_passes()
+                    manager = PassManager(passes)
+                    graph = manager.run(cos)
+                    if args.dump_ir:
+                        graph.dump()
+                    if args.report:
+                        for name, line, description in manager.report:
+                            print(f'[{line}]: {name}: {description}', file=sys.stderr)
+                    MatrixChainOptimizer().optimize(cos)
+                    fuse(cos)
+                    result = engines[args.engine](cos, source=file_contents,
+                                                  passes=[type(p).__name__ for p in passes],
+                                                  filename=file_path, cache_dir=args.cache_dir,
+                                                  jit_threshold=args.jit_threshold)
+                    if isinstance(result, Jit):
+                        print(f'jit: {result.compiled_loops} compiled loops, '
+                              f'{result.guard_failures} guard failures', file=sys.stderr)
+                    if args.pool_stats:
+                        print(f'pool: {pool.hits} hits, {pool.misses} misses', file=sys.stderr)
             except LexError as e:
                 print(f"Lexer error: {e}")
@@ -14,6 +14,7 @@ class Mparser(Parser):
         # ('nonassoc', 'IF'),
         ('nonassoc', 'ELSE'),
         # ('right', 'MULASSIGN', 'DIVASSIGN', 'SUBASSIGN', 'ADDASSIGN'),
+        ('nonassoc', 'LT', 'LEQ', 'GT', 'GEQ', 'EQ', 'NEQ'),
         ("left", '+', '-'),
         ("left", "MATADD", "MATSUB"),
         ("left", '*', '/'),
@@ -117,23 +118,41 @@ class Mparser(Parser):
     def matrix_ref(self, p):
         return AST.MatrixRef(p[0], p[2], p[4], line=p.lineno)
 
-    @_('var "[" number "]"',
+    @_('var "[" expr "]"',
        'var "[" range "]"', )
     def vector_ref(self, p):
         return AST.VectorRef(p[0], p[2], line=p.lineno)
 
-    @_('EYE "(" number ")"',
-       'ONES "(" number ")"',
-       'ZEROS "(" number ")"')
+    @_('EYE "(" expr ")"',
+       'ONES "(" expr ")"',
+       'ZEROS "(" expr ")"')
     def matrix_function(self, p):
         return AST.MatrixFunction(p[0], [p[2]], line=p.lineno)
 
-    @_('EYE "(" number "," number ")"',
-       'ONES "(" number "," number ")"',
-       'ZEROS "(" number "," number ")"')
+    @_('EYE "(" expr "," expr ")"',
+       'ONES "(" expr "," expr ")"',
+       'ZEROS "(" expr "," expr ")"')
     def matrix_function(self, p):
         return AST.MatrixFunction(p[0], [p[2], p[4]], line=p.lineno)
 
+    # any name, TypeChecker looks it up in Builtins.functions, so the names
+    # of builtins stay free for variables
+    @_('ID "(" arguments ")"')
+    def function_call(self, p):
+        return AST.FunctionCall(p[0], p[2], line=p.lineno)
+
+    @_('arguments "," argument',
+       'argument')
+    def arguments(self, p):
+        if len(p) == 1:
+            return [p[0]]
+        return p[0] + [p[2]]
+
+    @_('expr',
+       'range')
+    def argument(self, p):
+        return p[0]
+
     @_('var assign_op expr',
        'matrix_ref assign_op expr',
        'vector_ref assign_op expr', )
@@ -144,15 +163,15 @@ class Mparser(Parser):
     def var(self, p):
         return AST.Var(p[0], line=p.lineno)
 
-    @_('IF "(" condition ")" instruction %prec IFX')
+    @_('IF "(" expr ")" instruction %prec IFX')
     def instruction(self, p):
         return AST.If(p[2], p[4], line=p.lineno)
 
-    @_('IF "(" condition ")" instruction ELSE instruction')
+    @_('IF "(" expr ")" instruction ELSE instruction')
     def instruction(self, p):
         return AST.Ifelse(p[2], p[4], p[6], line=p.lineno)
 
-    @_('WHILE "(" condition ")" instruction')
+    @_('WHILE "(" expr ")" instruction')
     def instruction(self, p):
         return AST.While(p[2], p[4], line=p.lineno)
 
@@ -218,8 +237,10 @@ class Mparser(Parser):
        'uminus',
        'matrix',
        'vector',
+       'condition',
        'transposition',
        'matrix_function',
+       'function_call',
        'matrix_ref',
        'vector_ref',
        'number')
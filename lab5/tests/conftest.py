@@ -0,0 +1,42 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import Mparser
+from scanner import Scanner
+from TypeChecker import TypeChecker
+from IR import PassManager
+from MatrixChain import MatrixChainOptimizer
+from Fusion import fuse
+from main5 import engines, default_passes
+
+
+def parse(source):
+    return Mparser().parse(Scanner().tokenize(source))
+
+
+def compile_program(source, optimize=True):
+    # the tree main5 hands an engine: type-checked, optimized and fused
+    program = parse(source)
+    with contextlib.redirect_stdout(io.StringIO()):
+        TypeChecker().visit(program)
+    PassManager(default_passes() if optimize else []).run(program)
+    MatrixChainOptimizer().optimize(program)
+    fuse(program)
+    return program
+
+
+@pytest.fixture
+def run():
+    def run(source, engine='interpreter', optimize=True):
+        program = compile_program(source, optimize)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            engines[engine](program)
+        return output.getvalue()
+    return run
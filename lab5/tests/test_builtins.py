@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import Builtins
+from Builtins import functions, solve_size
+
+
+def permuted(matrix, pivots):
+    # the rows of matrix exchanged as getrf's pivots say
+    matrix = np.array(matrix, dtype=float)
+    for k, pivot in enumerate(pivots):
+        matrix[[k, pivot]] = matrix[[pivot, k]]
+    return matrix
+
+
+@pytest.mark.parametrize('scipy', [True, False])
+def test_lu_keeps_pivots(scipy, monkeypatch):
+    if not scipy:
+        monkeypatch.setattr(Builtins, 'lu_factor', None)
+    elif Builtins.lu_factor is None:
+        pytest.skip('scipy is not installed')
+    A = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 10.0]])
+    result = functions['lu'].function([A])
+    factors, pivots = result[:, :-1], result[:, -1].astype(int)
+    lower = np.tril(factors, -1) + np.eye(3)
+    upper = np.triu(factors)
+    assert np.allclose(lower @ upper, permuted(A, pivots))
+    assert functions['lu'].shape([(3, 3)]) == (3, 4)
+
+
+def test_solve_needs_as_many_rows():
+    assert solve_size([(2, 2), (2, 1)]) == (2, 1)
+    with pytest.raises(ValueError):
+        solve_size([(2, 2), (1, 2)])
+
+
+def test_solve_with_a_column(run):
+    assert run('x = solve(eye(2) * 2, [2, 4]\'); print x;') == '[[1.0], [2.0]]\n'
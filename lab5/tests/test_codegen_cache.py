@@ -0,0 +1,34 @@
+import contextlib
+import io
+
+import CodeGenerator
+from conftest import compile_program
+
+SOURCE = 'x = 0; for i = 1:3 { x += i; } print x;'
+
+
+def run_cached(source, passes, cache_dir):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        CodeGenerator.CodeGenerator().run(compile_program(source), source, passes, 'cached.m', cache_dir)
+    return output.getvalue()
+
+
+def test_hit_skips_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(CodeGenerator, 'code_cache', {})
+    assert run_cached(SOURCE, ['ConstantPropagation'], str(tmp_path)) == '6\n'
+    # a fresh process only has the disk cache
+    monkeypatch.setattr(CodeGenerator, 'code_cache', {})
+
+    def generate(self, program):
+        raise AssertionError('generate() called on a cache hit')
+
+    monkeypatch.setattr(CodeGenerator.CodeGenerator, 'generate', generate)
+    assert run_cached(SOURCE, ['ConstantPropagation'], str(tmp_path)) == '6\n'
+
+
+def test_key_covers_passes_and_version(monkeypatch):
+    key = CodeGenerator.source_hash(SOURCE, ['ConstantPropagation'], 'cached.m')
+    assert key != CodeGenerator.source_hash(SOURCE, [], 'cached.m')
+    monkeypatch.setattr(CodeGenerator, 'VERSION', CodeGenerator.VERSION + 1)
+    assert key != CodeGenerator.source_hash(SOURCE, ['ConstantPropagation'], 'cached.m')
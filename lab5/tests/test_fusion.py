@@ -0,0 +1,16 @@
+import pytest
+
+from main5 import engines
+
+
+@pytest.mark.parametrize('engine', list(engines))
+def test_scalar_minus_keeps_python_ints(run, engine):
+    # --a on a scalar is not fused, an np.int64 would wrap around here
+    output = run('a = 3000000000; c = --a; print c * c * c;', engine)
+    assert output.splitlines()[0] == str(3000000000 ** 3)
+
+
+@pytest.mark.parametrize('engine', list(engines))
+def test_matrix_trees_are_fused(run, engine):
+    output = run('A = [[1, 2]]; print --A, A .+ 1 .* 2;', engine)
+    assert output.splitlines()[0] == '[[1, 2]] [[3, 4]]'
@@ -0,0 +1,19 @@
+import contextlib
+import io
+
+import AST
+from TypeChecker import TypeChecker
+from conftest import parse
+
+
+def test_builtin_names_are_variables(run):
+    program = parse('sum = 0; max = 3; print sum + max, sum([1, 2]);')
+    assert isinstance(program.instructions[0].var, AST.Var)
+    assert run('sum = 0; max = 3; print sum + max, sum([1, 2]);') == '3 3\n'
+
+
+def test_unknown_function_is_an_error():
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        TypeChecker().visit(parse('x = total([1, 2]);'))
+    assert 'Undefined function total' in output.getvalue()
@@ -0,0 +1,31 @@
+import contextlib
+import io
+
+import pytest
+
+from TypeChecker import TypeChecker
+from conftest import parse
+
+
+def element_types(source):
+    # the types TypeChecker gives the expressions the last print shows
+    program = parse(source)
+    with contextlib.redirect_stdout(io.StringIO()):
+        TypeChecker().visit(program)
+    return [value.type for value in program.instructions[-1].to_print.values]
+
+
+@pytest.mark.parametrize('source, expected', [
+    ('A = [[1, 2], [3, 4]]; print A[0, 1];', 'int'),
+    ('A = [[1.5, 2.5], [3.5, 4.5]]; print A[0, 1];', 'float'),
+    ('A = [[1, 2], [3.5, 4.5]]; print A[0, 1];', 'float'),
+    ('A = zeros(2); print A[0, 1];', 'int'),
+    ('A = zeros(2) / 2; print A[0, 1];', 'float'),
+    ('A = zeros(2); A[1, 1] = 0.5; print A[0, 1];', 'float'),
+    ('A = eye(2); B = A[0:2, 0:1]; print B[1, 0];', 'int'),
+    ('A = inv([[1, 2], [3, 4]]); print A[0, 1];', 'float'),
+    ('v = [1, 2, 3]; print v[1];', 'int'),
+    ('v = [1.5, 2.5]; print v[1];', 'float'),
+])
+def test_element_type(source, expected):
+    assert element_types(source) == [expected]
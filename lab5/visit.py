@@ -1,4 +1,5 @@
 import inspect
+from types import MethodType
 
 __all__ = ['on', 'when']
 
@@ -15,14 +16,8 @@ def when(param_type):
         frame = inspect.currentframe().f_back
         func_name = fn.func_name if 'func_name' in dir(fn) else fn.__name__
         dispatcher = frame.f_locals[func_name]
-        if not isinstance(dispatcher, Dispatcher):
-            dispatcher = dispatcher.dispatcher
         dispatcher.add_target(param_type, fn)
-
-        def ff(*args, **kw):
-            return dispatcher(*args, **kw)
-        ff.dispatcher = dispatcher
-        return ff
+        return dispatcher
     return f
 
 
@@ -30,21 +25,33 @@ class Dispatcher(object):
     def __init__(self, param_name, fn):
         self.param_index = self.__argspec(fn).args.index(param_name)
         self.param_name = param_name
+        self.default = fn
         self.targets = {}
+        # class -> target, filled lazily so every class is resolved only once
+        self.table = {}
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return MethodType(self, obj)
 
     def __call__(self, *args, **kw):
         typ = args[self.param_index].__class__
-        d = self.targets.get(typ)
-        if d is not None:
-            return d(*args, **kw)
-        else:
-            issub = issubclass
-            t = self.targets
-            ks = iter(t)
-            return [t[k](*args, **kw) for k in ks if issub(typ, k)]
+        try:
+            target = self.table[typ]
+        except KeyError:
+            target = self.resolve(typ)
+        return target(*args, **kw)
+
+    def resolve(self, typ):
+        # the most specific registered base class wins, like method lookup
+        target = next((self.targets[k] for k in typ.__mro__ if k in self.targets), self.default)
+        self.table[typ] = target
+        return target
 
     def add_target(self, typ, target):
         self.targets[typ] = target
+        self.table.clear()
 
     @staticmethod
     def __argspec(fn):
@@ -52,4 +59,4 @@ class Dispatcher(object):
         if hasattr(inspect, 'getfullargspec'):
             return inspect.getfullargspec(fn)
         else:
-            return inspect.getargspec(fn)
\ No newline at end of file
+            return inspect.getargspec(fn)